@@ -1,32 +1,32 @@
 import os
 import json
+import logging
 from flask import Blueprint, render_template, request, jsonify
 from dotenv import load_dotenv
 from datetime import datetime
-import pandas as pd
 
 # LangChain Imports
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 
+from embedding_backends import missing_api_key
+from embedding_cache import get_embedding_cache
+from event_store import get_store, FEEDBACK_LOG, APP_FEEDBACK
+from analytics import get_analytics, parse_date_range
+import evaluation_jobs
+from evaluation_jobs import resume_incomplete_runs
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-FEEDBACK_FILE = 'feedback_log.json'
 GOLDEN_DATASET_FILE = 'golden_dataset.json'
-FAISS_INDEX_PATH = "faiss_index"
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 def load_feedback():
-    if os.path.exists(FEEDBACK_FILE):
-        try:
-            with open(FEEDBACK_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return []
-    return []
+    return get_store(FEEDBACK_LOG).read_all()
 
 def load_golden_dataset():
     if os.path.exists(GOLDEN_DATASET_FILE):
@@ -80,7 +80,7 @@ def save_golden():
 
 @admin_bp.route('/ingest_golden', methods=['POST'])
 def ingest_golden():
-    if not GOOGLE_API_KEY:
+    if missing_api_key():
         return jsonify({"status": "error", "message": "GOOGLE_API_KEY not found"}), 500
         
     try:
@@ -92,18 +92,14 @@ def ingest_golden():
         content = f"Question: {question}\nAnswer: {answer}"
         doc = Document(page_content=content, metadata={"source": "Golden Dataset"})
         
-        # Initialize Embeddings
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        
-        # Load or Create Index
-        if os.path.exists(FAISS_INDEX_PATH):
-            vectorstore = FAISS.load_local(FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-            vectorstore.add_documents([doc])
-        else:
-            vectorstore = FAISS.from_documents([doc], embeddings)
-            
-        # Save Index
-        vectorstore.save_local(FAISS_INDEX_PATH)
+        # Add to the shared index in place; chat users see it immediately
+        from vector_store import get_vector_store  # FAISS is only loaded when needed
+        get_vector_store().add_documents([doc])
+
+        # Cached answers may predate the new golden entry
+        from service_desk_bot import answer_cache
+        if answer_cache is not None:
+            answer_cache.invalidate("golden dataset ingested")
         
         # Update local record
         record = {
@@ -126,19 +122,13 @@ def delete_feedback():
         target_timestamp = data.get('timestamp')
         target_query = data.get('user_query')
         
-        feedback_data = load_feedback()
-        
-        new_feedback_data = [
-            item for item in feedback_data 
-            if not (item.get('timestamp') == target_timestamp and item.get('user_query') == target_query)
-        ]
+        removed = get_store(FEEDBACK_LOG).delete_where(
+            lambda item: item.get('timestamp') == target_timestamp and item.get('user_query') == target_query
+        )
         
-        if len(new_feedback_data) == len(feedback_data):
+        if not removed:
             return jsonify({"status": "error", "message": "Record not found"}), 404
             
-        with open(FEEDBACK_FILE, 'w') as f:
-            json.dump(new_feedback_data, f, indent=4)
-            
         return jsonify({"status": "success", "message": "Feedback deleted"})
         
     except Exception as e:
@@ -146,16 +136,8 @@ def delete_feedback():
 
 # --- App Feedback Routes ---
 
-APP_FEEDBACK_FILE = 'app_feedback.json'
-
 def load_app_feedback():
-    if os.path.exists(APP_FEEDBACK_FILE):
-        try:
-            with open(APP_FEEDBACK_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return []
-    return []
+    return get_store(APP_FEEDBACK).read_all()
 
 @admin_bp.route('/app_feedback')
 def app_feedback_view():
@@ -169,89 +151,53 @@ def delete_app_feedback():
         data = request.json
         target_id = data.get('id')
         
-        feedback_data = load_app_feedback()
-        new_feedback_data = [item for item in feedback_data if item.get('id') != target_id]
+        removed = get_store(APP_FEEDBACK).delete_where(lambda item: item.get('id') == target_id)
         
-        if len(new_feedback_data) == len(feedback_data):
+        if not removed:
             return jsonify({"status": "error", "message": "Record not found"}), 404
             
-        with open(APP_FEEDBACK_FILE, 'w') as f:
-            json.dump(new_feedback_data, f, indent=4)
-            
         return jsonify({"status": "success", "message": "Feedback deleted"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # --- Analytics Routes ---
 
-QUERY_LOG_FILE = 'query_log.json'
-
-def load_query_log():
-    if os.path.exists(QUERY_LOG_FILE):
-        try:
-            with open(QUERY_LOG_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return []
-    return []
-
 @admin_bp.route('/analytics')
 def analytics_view():
-    chat_feedback = load_feedback()
     golden_data = load_golden_dataset()
-    query_log = load_query_log()
     
-    total_queries = len(query_log)
-    
-    response_times = [item.get('response_time', 0) for item in query_log if item.get('response_time')]
-    avg_response_time = round(sum(response_times) / len(response_times), 2) if response_times else 0
-    
-    total_feedback = len(chat_feedback)
-    positive_ratings = sum(1 for item in chat_feedback if item.get('rating') == 1)
-    satisfaction_rate = int((positive_ratings / total_feedback * 100) if total_feedback > 0 else 0)
+    # Aggregates come from incrementally maintained rollups, not the raw logs
+    start, end = parse_date_range(request.args.get('start'), request.args.get('end'))
+    summary = get_analytics().summary(start, end)
     
     ingested_count = sum(1 for item in golden_data if item.get('ingested', False))
     ingestion_rate = int((ingested_count / len(golden_data) * 100) if len(golden_data) > 0 else 0)
     
-    from collections import defaultdict, Counter
-    from datetime import timedelta
+    label_format = '%a' if len(summary["days"]) <= 7 else '%d %b'
+    chart_labels = [datetime.fromisoformat(d).strftime(label_format) for d in summary["days"]]
     
-    today = datetime.now().date()
-    dates = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
-    volume_data = defaultdict(int)
-    
-    for item in query_log:
-        try:
-            ts = datetime.fromisoformat(item.get('timestamp')).date().isoformat()
-            if ts in dates:
-                volume_data[ts] += 1
-        except:
-            pass
-            
-    chart_volume = [volume_data[d] for d in dates]
-    chart_labels = [datetime.fromisoformat(d).strftime('%a') for d in dates]
-    
-    sentiment_counts = Counter()
-    for item in chat_feedback:
-        r = item.get('rating')
-        if r == 1: sentiment_counts['Positive'] += 1
-        elif r == -1: sentiment_counts['Negative'] += 1
-        else: sentiment_counts['Neutral'] += 1
-        
-    chart_sentiment = [sentiment_counts['Positive'], sentiment_counts['Negative'], sentiment_counts['Neutral']]
-    
-    query_counts = Counter(item.get('query') for item in query_log if item.get('query'))
-    top_queries = [{"query": q, "count": c} for q, c in query_counts.most_common(5)]
+    from service_desk_bot import answer_cache
+    cache_stats = answer_cache.stats() if answer_cache is not None else {"enabled": False}
+    embedding_cache_stats = get_embedding_cache().stats()
     
     metrics = {
-        "total_queries": total_queries,
-        "avg_response_time": avg_response_time,
-        "satisfaction_rate": satisfaction_rate,
+        "total_queries": summary["total_queries"],
+        "all_time_queries": summary["all_time_queries"],
+        "avg_response_time": summary["avg_response_time"],
+        "p50_response_time": summary["p50"],
+        "p95_response_time": summary["p95"],
+        "p99_response_time": summary["p99"],
+        "satisfaction_rate": summary["satisfaction_rate"],
         "ingestion_rate": ingestion_rate,
-        "chart_volume": chart_volume,
+        "chart_volume": summary["volume"],
         "chart_labels": chart_labels,
-        "chart_sentiment": chart_sentiment,
-        "top_queries": top_queries
+        "chart_sentiment": summary["sentiment"],
+        "top_queries": summary["top_queries"],
+        "stages": summary["stages"],
+        "range_start": start.isoformat(),
+        "range_end": end.isoformat(),
+        "cache": cache_stats,
+        "embedding_cache": embedding_cache_stats
     }
     
     return render_template('admin_analytics.html', metrics=metrics)
@@ -260,105 +206,41 @@ def analytics_view():
 
 @admin_bp.route('/evaluation')
 def evaluation_view():
+    # Pick up runs interrupted by a crash or restart
+    resume_incomplete_runs()
     return render_template('admin_evaluation.html')
 
 @admin_bp.route('/run_evaluation', methods=['POST'])
 def run_evaluation():
+    if not GOOGLE_API_KEY:
+        return jsonify({"status": "error", "message": "GOOGLE_API_KEY not found"}), 500
     try:
-        # 1. Load Synthetic Data
-        synthetic_file = 'synthetic_dataset.json'
-        if not os.path.exists(synthetic_file):
-            return jsonify({"status": "error", "message": "Synthetic dataset not found. Please generate it first."}), 404
-            
-        with open(synthetic_file, 'r') as f:
-            test_data = json.load(f)
-            
-        # Limit to 10 for speed in this demo, or use all 50 if user insists (user asked for 50)
-        # I'll use 10 to avoid timeout, but the user asked for 50. I'll try 20.
-        test_data = test_data[:20] 
-        
-        questions = [item['question'] for item in test_data]
-        ground_truths = [[item['ground_truth']] for item in test_data]
-        
-        # 2. Run Inference (Get Answers & Contexts)
-        answers = []
-        contexts = []
-        
-        # Initialize Vector Store
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        vectorstore = FAISS.load_local(FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 2})
-        
-        # Initialize LLM for Answer Generation
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
-        
-        print(f"Running inference on {len(questions)} items...")
-        
-        for q in questions:
-            # Retrieve
-            docs = retriever.invoke(q)
-            ctx = [d.page_content for d in docs]
-            contexts.append(ctx)
-            
-            # Generate Answer
-            # Simple RAG chain for evaluation consistency
-            context_text = "\n\n".join(ctx)
-            prompt = f"Answer the question based on the context.\nContext: {context_text}\nQuestion: {q}\nAnswer:"
-            response = llm.invoke(prompt)
-            answers.append(response.content)
-            
-        # 3. Run RAGAS Evaluation
-        from datasets import Dataset
-        from ragas import evaluate
-        from ragas.metrics import faithfulness, answer_relevancy, context_precision
-        
-        data = {
-            "question": questions,
-            "answer": answers,
-            "contexts": contexts,
-            "ground_truth": ground_truths
-        }
-        
-        dataset = Dataset.from_dict(data)
-        
-        # Configure RAGAS with Gemini
-        # RAGAS uses default LLMs. We need to patch it or pass llm/embeddings.
-        # In recent RAGAS versions, we pass llm/embeddings to evaluate()
-        
-        print("Starting RAGAS evaluation...")
-        results = evaluate(
-            dataset=dataset,
-            metrics=[faithfulness, answer_relevancy, context_precision],
-            llm=llm,
-            embeddings=embeddings
-        )
-        
-        # 4. Format Results
-        df = results.to_pandas()
-        details = df.to_dict(orient='records')
-        
-        # Serialize details (handle NaN)
-        clean_details = []
-        for row in details:
-            clean_details.append({
-                "question": row['question'],
-                "faithfulness": 0 if pd.isna(row['faithfulness']) else row['faithfulness'],
-                "answer_relevancy": 0 if pd.isna(row['answer_relevancy']) else row['answer_relevancy'],
-                "context_precision": 0 if pd.isna(row['context_precision']) else row['context_precision']
-            })
-            
-        response_data = {
-            "faithfulness": results['faithfulness'],
-            "answer_relevancy": results['answer_relevancy'],
-            "context_precision": results['context_precision'],
-            "details": clean_details
-        }
-        
-        return jsonify({"status": "success", "results": response_data})
-        
+        dataset = (request.get_json(silent=True) or {}).get('dataset', 'all')
+        if dataset not in ('all', 'synthetic', 'golden'):
+            return jsonify({"status": "error", "message": f"Unknown dataset '{dataset}'"}), 400
+        run = evaluation_jobs.start_run(dataset)
+        return jsonify({"status": "success", "run": run})
+    except FileNotFoundError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
     except Exception as e:
-        print(f"Evaluation error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("Evaluation error: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
+
+@admin_bp.route('/evaluation/runs')
+def evaluation_runs():
+    resume_incomplete_runs()
+    return jsonify({"status": "success", "runs": evaluation_jobs.list_runs()})
+
+@admin_bp.route('/evaluation/runs/<run_id>')
+def evaluation_run_status(run_id):
+    run = evaluation_jobs.get_run(run_id)
+    if not run:
+        return jsonify({"status": "error", "message": "Run not found"}), 404
+    return jsonify({"status": "success", "run": run})
+
+@admin_bp.route('/evaluation/runs/<run_id>/retry', methods=['POST'])
+def retry_evaluation_run(run_id):
+    run = evaluation_jobs.retry_run(run_id)
+    if not run:
+        return jsonify({"status": "error", "message": "Run not found"}), 404
+    return jsonify({"status": "success", "run": run})
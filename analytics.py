@@ -0,0 +1,287 @@
+# analytics.py
+"""
+Pre-aggregated analytics for the admin dashboard.
+
+Instead of loading the full query and feedback logs on every page view, rollups are
+kept per day (query counts, a log-scaled latency histogram, rating tallies and a
+small heavy-hitters sketch of top queries, per-stage latency from request traces)
+and advanced incrementally from the event stores' append position. Only records written since the last refresh are read,
+so the page cost depends on the date range, not on how much history is kept.
+
+Rollups are persisted to ANALYTICS_ROLLUPS_PATH and shared by all worker processes.
+"""
+import os
+import json
+import math
+import threading
+import logging
+from datetime import datetime, date, timedelta
+
+from event_store import get_store, QUERY_LOG, FEEDBACK_LOG
+from file_lock import locked_file
+from tracing import get_trace_store, span_durations, TRACE_LOG
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ROLLUPS_PATH = os.getenv("ANALYTICS_ROLLUPS_PATH", "analytics_rollups.json")
+ROLLUP_VERSION = 3
+
+# Latency buckets: upper edges grow by 15% from 50 ms, so percentiles are within ~7%
+LATENCY_BASE = 0.05
+LATENCY_GROWTH = 1.15
+LATENCY_BUCKETS = 80  # Last bucket catches everything above ~3.5 min
+STAGE_LATENCY_BASE = 0.001  # Trace stages (embedding, FAISS search) are often well under 50 ms
+
+TOP_QUERIES_PER_DAY = 50  # Space-Saving sketch capacity per day
+MAX_RANGE_DAYS = 366
+
+
+def latency_bucket(seconds, base=LATENCY_BASE):
+    if seconds <= base:
+        return 0
+    index = int(math.ceil(math.log(seconds / base, LATENCY_GROWTH)))
+    return min(index, LATENCY_BUCKETS - 1)
+
+
+def bucket_upper_edge(index, base=LATENCY_BASE):
+    return base * (LATENCY_GROWTH ** index)
+
+
+def sketch_add(sketch, item, capacity=TOP_QUERIES_PER_DAY):
+    """
+    Space-Saving heavy hitters: exact while there are fewer than `capacity` distinct
+    items, otherwise the smallest counter is replaced and its count inherited, so
+    frequent items are never undercounted.
+    """
+    if item in sketch:
+        sketch[item] += 1
+    elif len(sketch) < capacity:
+        sketch[item] = 1
+    else:
+        smallest = min(sketch, key=sketch.get)
+        sketch[item] = sketch.pop(smallest) + 1
+
+
+def _day_of(record):
+    try:
+        return datetime.fromisoformat(record.get('timestamp')).date().isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def percentile_from_histogram(histogram, total, pct, base=LATENCY_BASE, digits=2):
+    if not total:
+        return 0
+    rank = pct / 100 * total
+    seen = 0
+    for index in range(LATENCY_BUCKETS):
+        seen += histogram.get(index, 0)
+        if seen >= rank:
+            return round(bucket_upper_edge(index, base), digits)
+    return round(bucket_upper_edge(LATENCY_BUCKETS - 1, base), digits)
+
+
+class AnalyticsRollups:
+    def __init__(self, path=ANALYTICS_ROLLUPS_PATH):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._lock = threading.Lock()
+        self._data = None
+        self._mtime = None
+
+    # --- Maintenance ---
+
+    def _empty(self):
+        return {"version": ROLLUP_VERSION, "cursors": {}, "queries": {}, "ratings": {}, "stages": {}}
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            self._data, self._mtime = self._empty(), None
+            return
+        if self._data is not None and mtime == self._mtime:
+            return  # In-memory copy is current
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self._data = data if data.get("version") == ROLLUP_VERSION else self._empty()
+        except (OSError, json.JSONDecodeError):
+            self._data = self._empty()
+        self._mtime = mtime
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _apply_query(self, record):
+        day = _day_of(record)
+        if not day:
+            return
+        rollup = self._data["queries"].setdefault(day, {"count": 0, "latency_sum": 0.0, "latency_count": 0,
+                                                        "histogram": {}, "top": {}})
+        rollup["count"] += 1
+        latency = record.get('response_time')
+        if latency is not None:
+            rollup["latency_sum"] += latency
+            rollup["latency_count"] += 1
+            bucket = str(latency_bucket(latency))
+            rollup["histogram"][bucket] = rollup["histogram"].get(bucket, 0) + 1
+        query = (record.get('query') or "").strip()
+        if query:
+            sketch_add(rollup["top"], query)
+
+    def _apply_feedback(self, record):
+        day = _day_of(record)
+        if not day:
+            return
+        rollup = self._data["ratings"].setdefault(day, {"positive": 0, "negative": 0, "neutral": 0})
+        rating = record.get('rating')
+        if rating == 1:
+            rollup["positive"] += 1
+        elif rating == -1:
+            rollup["negative"] += 1
+        else:
+            rollup["neutral"] += 1
+
+    def _apply_trace(self, record):
+        for started, name, seconds in span_durations(record):
+            if started is None:
+                continue
+            day = datetime.fromtimestamp(started).date().isoformat()
+            rollup = self._data["stages"].setdefault(day, {}).setdefault(name, {"count": 0, "sum": 0.0, "histogram": {}})
+            rollup["count"] += 1
+            rollup["sum"] += seconds
+            bucket = str(latency_bucket(seconds, STAGE_LATENCY_BASE))
+            rollup["histogram"][bucket] = rollup["histogram"].get(bucket, 0) + 1
+
+    def refresh(self):
+        """Folds in records appended since the last refresh (by any process)."""
+        with self._lock, locked_file(self.lock_path):
+            self._load()
+            changed = False
+            for store_name, store, section, apply in (
+                (QUERY_LOG, get_store(QUERY_LOG), "queries", self._apply_query),
+                (FEEDBACK_LOG, get_store(FEEDBACK_LOG), "ratings", self._apply_feedback),
+                (TRACE_LOG, get_trace_store(), "stages", self._apply_trace),
+            ):
+                cursor = self._data["cursors"].get(store_name)
+                records, new_cursor, reset = store.read_since(cursor)
+                if reset:
+                    logger.info("%s records were deleted, rebuilding its rollups.", store_name)
+                    self._data[section] = {}
+                for record in records:
+                    apply(record)
+                if records or reset or new_cursor != cursor:
+                    self._data["cursors"][store_name] = new_cursor
+                    changed = True
+            if changed:
+                self._save()
+
+    # --- Queries ---
+
+    def summary(self, start, end):
+        """Aggregates the rollups for the inclusive date range [start, end]."""
+        self.refresh()
+        days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+        with self._lock:
+            queries = self._data["queries"]
+            ratings = self._data["ratings"]
+
+            volume = []
+            histogram = {}
+            latency_sum, latency_count = 0.0, 0
+            top = {}
+            for day in days:
+                rollup = queries.get(day)
+                volume.append(rollup["count"] if rollup else 0)
+                if not rollup:
+                    continue
+                latency_sum += rollup["latency_sum"]
+                latency_count += rollup["latency_count"]
+                for bucket, count in rollup["histogram"].items():
+                    histogram[int(bucket)] = histogram.get(int(bucket), 0) + count
+                for query, count in rollup["top"].items():
+                    top[query] = top.get(query, 0) + count
+
+            sentiment = {"positive": 0, "negative": 0, "neutral": 0}
+            for day in days:
+                for key, count in ratings.get(day, {}).items():
+                    sentiment[key] += count
+
+            all_time_queries = sum(r["count"] for r in queries.values())
+
+            stage_totals = {}
+            for day in days:
+                for name, rollup in self._data["stages"].get(day, {}).items():
+                    total = stage_totals.setdefault(name, {"count": 0, "sum": 0.0, "histogram": {}})
+                    total["count"] += rollup["count"]
+                    total["sum"] += rollup["sum"]
+                    for bucket, count in rollup["histogram"].items():
+                        total["histogram"][int(bucket)] = total["histogram"].get(int(bucket), 0) + count
+
+        total_feedback = sum(sentiment.values())
+        top_queries = sorted(top.items(), key=lambda item: item[1], reverse=True)[:5]
+        return {
+            "days": days,
+            "volume": volume,
+            "total_queries": sum(volume),
+            "all_time_queries": all_time_queries,
+            "avg_response_time": round(latency_sum / latency_count, 2) if latency_count else 0,
+            "p50": percentile_from_histogram(histogram, latency_count, 50),
+            "p95": percentile_from_histogram(histogram, latency_count, 95),
+            "p99": percentile_from_histogram(histogram, latency_count, 99),
+            "sentiment": [sentiment["positive"], sentiment["negative"], sentiment["neutral"]],
+            "satisfaction_rate": int(sentiment["positive"] / total_feedback * 100) if total_feedback else 0,
+            "top_queries": [{"query": q, "count": c} for q, c in top_queries],
+            "stages": self._stage_summary(stage_totals),
+        }
+
+    @staticmethod
+    def _stage_summary(stage_totals):
+        """Per-stage latency, slowest total first; `share` is the stage's time relative to whole requests."""
+        request_time = stage_totals.get("chat.request", {}).get("sum", 0)
+        stages = []
+        for name, total in sorted(stage_totals.items(), key=lambda item: item[1]["sum"], reverse=True):
+            stages.append({
+                "name": name,
+                "count": total["count"],
+                "avg_ms": round(total["sum"] / total["count"] * 1000, 1) if total["count"] else 0,
+                "p95_ms": round(percentile_from_histogram(total["histogram"], total["count"], 95,
+                                                          base=STAGE_LATENCY_BASE, digits=4) * 1000, 1),
+                "share": int(total["sum"] / request_time * 100) if request_time else None,
+            })
+        return stages
+
+
+_rollups = None
+_rollups_lock = threading.Lock()
+
+
+def get_analytics():
+    global _rollups
+    with _rollups_lock:
+        if _rollups is None:
+            _rollups = AnalyticsRollups()
+        return _rollups
+
+
+def parse_date_range(start_arg, end_arg, default_days=7):
+    """Parses ?start=YYYY-MM-DD&end=YYYY-MM-DD, defaulting to the last `default_days` days."""
+    today = date.today()
+    try:
+        end = date.fromisoformat(end_arg) if end_arg else today
+    except ValueError:
+        end = today
+    try:
+        start = date.fromisoformat(start_arg) if start_arg else end - timedelta(days=default_days - 1)
+    except ValueError:
+        start = end - timedelta(days=default_days - 1)
+    if start > end:
+        start, end = end, start
+    if (end - start).days > MAX_RANGE_DAYS:
+        start = end - timedelta(days=MAX_RANGE_DAYS)
+    return start, end
@@ -0,0 +1,154 @@
+# answer_cache.py
+"""
+Semantic answer cache for the Service Desk agent.
+
+Final answers are stored against the embedding of the normalised question, so a
+repeat (or near-identical) question is answered without running the ReAct loop.
+Entries expire after a TTL, the cache is bounded with LRU eviction, and the whole
+cache is dropped whenever the FAISS index on disk changes.
+"""
+import os
+import re
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from index_layout import index_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # Cosine similarity
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60)))  # Seconds
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+
+
+def normalize_query(text):
+    """Lowercases and collapses whitespace so trivially different questions share a key."""
+    return re.sub(r"\s+", " ", (text or "")).strip().casefold()
+
+
+class SemanticAnswerCache:
+    def __init__(self, index_path, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.index_path = index_path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # normalised query -> entry, oldest first
+        self._matrix = None  # Stacked unit vectors, rebuilt lazily after changes
+        self._matrix_keys = []
+        self._fingerprint = index_fingerprint(index_path)
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, query, embed_fn):
+        """
+        Looks up a cached answer for `query`.
+        Exact (normalised) matches skip the embedding call entirely; otherwise
+        `embed_fn(text)` is called once and the nearest cached question is used
+        if it clears the similarity threshold.
+        Returns (entry or None, unit query vector or None).
+        """
+        key = normalize_query(query)
+        with self._lock:
+            self._check_index()
+            self._expire()
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, entry["vector"]
+
+        vector = _unit(embed_fn(key))
+
+        with self._lock:
+            match = self._nearest(vector)
+            if match:
+                self._entries.move_to_end(match["key"])
+                self.hits += 1
+            else:
+                self.misses += 1
+            return match, vector
+
+    def put(self, query, vector, answer_event):
+        """Stores the final answer event (content, sources, ...) for a question."""
+        key = normalize_query(query)
+        if vector is None:
+            return
+        with self._lock:
+            self._entries[key] = {
+                "key": key,
+                "vector": vector,
+                "created_at": time.time(),
+                "answer": {k: v for k, v in answer_event.items() if k != "type"},
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self, reason="manual"):
+        with self._lock:
+            self._clear(reason)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": True,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": int(self.hits / lookups * 100) if lookups else 0,
+                "invalidations": self.invalidations,
+            }
+
+    # --- Internal helpers (caller holds the lock) ---
+
+    def _clear(self, reason):
+        if self._entries:
+            logger.info("Answer cache invalidated (%s), dropping %d entries.", reason, len(self._entries))
+        self._entries.clear()
+        self._matrix = None
+        self.invalidations += 1
+        self._fingerprint = index_fingerprint(self.index_path)
+
+    def _check_index(self):
+        current = index_fingerprint(self.index_path)
+        if current != self._fingerprint:
+            self._clear("index changed")
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [k for k, e in self._entries.items() if e["created_at"] < cutoff]
+        for k in expired:
+            del self._entries[k]
+        if expired:
+            self._matrix = None
+
+    def _nearest(self, vector):
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.vstack([self._entries[k]["vector"] for k in self._matrix_keys])
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return self._entries[self._matrix_keys[best]]
+        return None
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -5,7 +5,12 @@ import logging
 from datetime import datetime
 from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context, send_from_directory
 from werkzeug import serving
-from service_desk_bot import ask_service_desk_stream
+from service_desk_bot import ask_service_desk_stream, client_status, warm_up
+from event_store import get_store, QUERY_LOG, FEEDBACK_LOG, APP_FEEDBACK
+from conversation_store import get_conversation_store, session_conversation, SESSION_KEY
+import tracing
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "supersecretkey")
@@ -14,6 +19,22 @@ app.secret_key = os.environ.get("FLASK_SECRET_KEY", "supersecretkey")
 from admin_routes import admin_bp
 app.register_blueprint(admin_bp)
 
+# Load the index and LLM client in the background; /readyz reports when they are up
+WARM_UP_ON_START = os.environ.get("WARM_UP_ON_START", "true").lower() == "true"
+if WARM_UP_ON_START:
+    warm_up()
+
+def log_query(user_input, duration):
+    """Logs a query for analytics (queued; flushed to the event store in the background)."""
+    try:
+        get_store(QUERY_LOG).append({
+            "timestamp": datetime.now().isoformat(),
+            "query": user_input,
+            "response_time": duration
+        })
+    except Exception as e:
+        logger.error("Failed to log query: %s", e)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -26,64 +47,62 @@ def chat():
     if not user_input:
         return jsonify({'error': 'Empty message'}), 400
 
-    # Get chat history safely
-    chat_history = session.get('chat_history', [])
+    # History lives server-side; the session cookie only carries the conversation id
+    conversation_id, _ = session_conversation(session)
+    conversations = get_conversation_store()
+    previous_history = conversations.history(conversation_id)
+    conversations.append(conversation_id, 'user', user_input)
 
     # Define generator for streaming
     def generate():
         start_time = time.time()
         
-        # Yield initial thinking state
-        yield json.dumps({"type": "log", "content": "Thinking..."}) + "\n"
-        
-        full_answer = ""
-        sources = []
-        needs_email_support = False
-        
-        # Stream events from the bot
-        for event in ask_service_desk_stream(user_input, chat_history, dev_settings):
-            yield json.dumps(event) + "\n"
+        with tracing.trace("chat.request", history_messages=len(previous_history), mode="wsgi"):
+            # Yield initial thinking state
+            yield json.dumps({"type": "log", "content": "Thinking..."}) + "\n"
             
-            if event['type'] == 'answer':
-                full_answer = event['content']
-                needs_email_support = event.get('needs_email_support', False)
-                sources = event.get('sources', [])
-
-        end_time = time.time()
-        duration = round(end_time - start_time, 2)
-
-        # Log query for analytics
-        try:
-            query_log_file = 'query_log.json'
-            if os.path.exists(query_log_file):
-                with open(query_log_file, 'r') as f:
-                    try:
-                        queries = json.load(f)
-                    except json.JSONDecodeError:
-                        queries = []
-            else:
-                queries = []
-                
-            queries.append({
-                "timestamp": datetime.now().isoformat(),
-                "query": user_input,
-                "response_time": duration
-            })
+            full_answer = ""
+            sources = []
+            needs_email_support = False
+            flush_seconds, events = 0.0, 0
             
-            with open(query_log_file, 'w') as f:
-                json.dump(queries, f, indent=4)
-        except Exception as e:
-            print(f"Failed to log query: {e}")
+            # Stream events from the bot
+            for event in ask_service_desk_stream(user_input, previous_history, dev_settings):
+                # Time suspended at the yield is the server writing the chunk to the client
+                flush_started = time.perf_counter()
+                yield json.dumps(event) + "\n"
+                flush_seconds += time.perf_counter() - flush_started
+                events += 1
+                
+                if event['type'] == 'answer':
+                    full_answer = event['content']
+                    needs_email_support = event.get('needs_email_support', False)
+                    sources = event.get('sources', [])
+
+            tracing.record_span("stream.flush", flush_seconds, events=events)
 
-    # Save user message to history
-    chat_history.append({'role': 'user', 'content': user_input})
-    session['chat_history'] = chat_history
-    session.modified = True
+        if full_answer:
+            conversations.append(conversation_id, 'assistant', full_answer)
+        end_time = time.time()
+        log_query(user_input, round(end_time - start_time, 2))
 
     return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is serving requests."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: clients initialised and the knowledge base loaded (503 until then)."""
+    status = client_status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 @app.route('/reset', methods=['POST'])
 def reset():
+    if SESSION_KEY in session:
+        get_conversation_store().clear(session[SESSION_KEY])
     session.clear()
     return jsonify({'status': 'ok'})
 
@@ -115,28 +134,13 @@ def feedback():
             "comment": data.get('comment', '')
         }
         
-        log_file = 'feedback_log.json'
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                try:
-                    logs = json.load(f)
-                except json.JSONDecodeError:
-                    logs = []
-        else:
-            logs = []
-            
-        logs.append(feedback_entry)
-        
-        with open(log_file, 'w') as f:
-            json.dump(logs, f, indent=4)
+        get_store(FEEDBACK_LOG).append(feedback_entry)
             
         return jsonify({"status": "success", "message": "Feedback received"})
     except Exception as e:
-        print(f"Feedback error: {e}")
+        logger.error("Feedback error: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
-APP_FEEDBACK_FILE = 'app_feedback.json'
-
 @app.route('/submit_app_feedback', methods=['POST'])
 def submit_app_feedback():
     try:
@@ -148,19 +152,7 @@ def submit_app_feedback():
             "comment": data.get('comment')
         }
         
-        if os.path.exists(APP_FEEDBACK_FILE):
-            try:
-                with open(APP_FEEDBACK_FILE, 'r') as f:
-                    feedback_data = json.load(f)
-            except json.JSONDecodeError:
-                feedback_data = []
-        else:
-            feedback_data = []
-            
-        feedback_data.append(record)
-        
-        with open(APP_FEEDBACK_FILE, 'w') as f:
-            json.dump(feedback_data, f, indent=4)
+        get_store(APP_FEEDBACK).append(record)
             
         return jsonify({"status": "success", "message": "Feedback submitted"})
     except Exception as e:
@@ -0,0 +1,107 @@
+# asgi.py
+"""
+ASGI entry point for high-concurrency serving.
+
+/chat is served natively on the event loop with ask_service_desk_astream, so a waiting
+request costs a coroutine rather than a worker thread and one process can hold hundreds
+of open answer streams. Upstream LLM calls are capped at LLM_MAX_CONCURRENCY and queue
+for a free slot. Every other route (admin, feedback, static files) is the unchanged
+Flask app, mounted through a WSGI adapter.
+
+Run with:
+    uvicorn asgi:app --host 127.0.0.1 --port 8090
+"""
+import os
+import json
+import time
+import asyncio
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, log_query
+from conversation_store import get_conversation_store, session_conversation
+from service_desk_bot import ask_service_desk_astream
+import tracing
+
+# Threads for the mounted Flask routes (admin pages, feedback); chat streams do not use them
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", "16"))
+
+# Flask's signed session cookie, so /chat shares the session with the Flask routes
+_session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+_session_cookie = flask_app.config["SESSION_COOKIE_NAME"]
+
+
+def load_session(request):
+    cookie = request.cookies.get(_session_cookie)
+    if not cookie:
+        return {}
+    try:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        return _session_serializer.loads(cookie, max_age=max_age)
+    except BadSignature:
+        return {}
+
+
+def save_session(response, session):
+    response.set_cookie(
+        _session_cookie,
+        _session_serializer.dumps(dict(session)),
+        httponly=flask_app.config["SESSION_COOKIE_HTTPONLY"],
+        secure=flask_app.config["SESSION_COOKIE_SECURE"],
+        samesite=flask_app.config["SESSION_COOKIE_SAMESITE"],
+        path=flask_app.config["SESSION_COOKIE_PATH"] or "/",
+    )
+
+
+async def chat(request):
+    form = await request.form()
+    user_input = form.get('user_input', '')
+    dev_settings = {}
+
+    if not user_input:
+        return JSONResponse({'error': 'Empty message'}, status_code=400)
+
+    # History lives server-side; the session cookie only carries the conversation id
+    session = load_session(request)
+    conversation_id, created = session_conversation(session)
+    conversations = get_conversation_store()
+    chat_history = await asyncio.to_thread(conversations.history, conversation_id)
+    await asyncio.to_thread(conversations.append, conversation_id, 'user', user_input)
+
+    async def generate():
+        start_time = time.time()
+
+        with tracing.trace("chat.request", history_messages=len(chat_history), mode="asgi"):
+            # Yield initial thinking state
+            yield json.dumps({"type": "log", "content": "Thinking..."}) + "\n"
+
+            full_answer = ""
+            flush_seconds, events = 0.0, 0
+            async for event in ask_service_desk_astream(user_input, chat_history, dev_settings):
+                flush_started = time.perf_counter()
+                yield json.dumps(event) + "\n"
+                flush_seconds += time.perf_counter() - flush_started
+                events += 1
+                if event['type'] == 'answer':
+                    full_answer = event['content']
+
+            tracing.record_span("stream.flush", flush_seconds, events=events)
+
+        if full_answer:
+            await asyncio.to_thread(conversations.append, conversation_id, 'assistant', full_answer)
+        log_query(user_input, round(time.time() - start_time, 2))
+
+    response = StreamingResponse(generate(), media_type='application/x-ndjson')
+    if created:
+        save_session(response, session)
+    return response
+
+
+app = Starlette(routes=[
+    Route('/chat', chat, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+])
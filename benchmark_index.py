@@ -0,0 +1,139 @@
+"""
+Recall-vs-latency benchmark for the FAISS index types in index_types.py.
+
+Takes the vectors of the current index (or a random corpus with --fake), optionally
+grows the corpus with perturbed copies to simulate a larger knowledge base, builds
+every index type from them and runs single-query searches the way lookup_guides does.
+Recall@k is measured against the exact (flat) results.
+
+Queries are the questions of the synthetic dataset, embedded with the configured
+backend (served from the embedding cache after the first run). With --fake, queries
+are perturbed corpus vectors and no API key is needed.
+
+    python benchmark_index.py --scale 100 --types flat,ivf,hnsw,ivfpq,sq8 --nprobe 8,16,32
+"""
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import faiss
+
+from index_types import (INDEX_TYPES, INDEX_NPROBE, INDEX_EF_SEARCH, build_index, apply_search_params,
+                         factory_string, index_vectors)
+from index_layout import INDEX_FILE, current_dir
+from vector_store import FAISS_INDEX_PATH
+
+QUERIES_PATH = "synthetic_dataset.json"
+
+
+def load_corpus(index_path):
+    index = faiss.read_index(os.path.join(current_dir(index_path), INDEX_FILE))
+    return np.ascontiguousarray(index_vectors(index), dtype="float32")
+
+
+def load_queries(path, limit):
+    from embedding_cache import get_embeddings
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)][:limit]
+    embeddings = get_embeddings()
+    return np.array([embeddings.embed_query(q) for q in questions], dtype="float32")
+
+
+def perturbed(vectors, copies, noise, rng):
+    """`copies` noisy copies of each vector, so neighbourhoods stay realistic as the corpus grows."""
+    if copies <= 0:
+        return vectors[:0]
+    repeated = np.repeat(vectors, copies, axis=0)
+    scale = noise * np.linalg.norm(vectors, axis=1).mean() / np.sqrt(vectors.shape[1])
+    return (repeated + rng.standard_normal(repeated.shape).astype("float32") * scale).astype("float32")
+
+
+def index_bytes(index):
+    return faiss.serialize_index(index).nbytes
+
+
+def run_queries(index, queries, k):
+    timings, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        timings.append(time.perf_counter() - started)
+        results.append(ids[0])
+    timings = np.array(timings) * 1000
+    return np.array(results), float(np.percentile(timings, 50)), float(np.percentile(timings, 95))
+
+
+def recall(results, truth, k):
+    hits = sum(len(set(r[:k]) & set(t[:k]) - {-1}) for r, t in zip(results, truth))
+    return hits / (len(truth) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FAISS index types on recall@k and search latency.")
+    parser.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="Comma-separated index types.")
+    parser.add_argument("--scale", type=int, default=1, help="Grow the corpus to this many times its size.")
+    parser.add_argument("--noise", type=float, default=0.3, help="Relative noise of the synthetic copies.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200, help="Maximum number of queries.")
+    parser.add_argument("--nprobe", default=str(INDEX_NPROBE), help="Comma-separated IVF nprobe values.")
+    parser.add_argument("--ef-search", default=str(INDEX_EF_SEARCH), help="Comma-separated HNSW efSearch values.")
+    parser.add_argument("--fake", action="store_true", help="Random corpus and queries (offline).")
+    parser.add_argument("--fake-size", type=int, default=2000, help="Corpus vectors with --fake.")
+    parser.add_argument("--dimension", type=int, default=768, help="Vector dimension with --fake.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.fake:
+        corpus = rng.standard_normal((args.fake_size, args.dimension)).astype("float32")
+        picks = corpus[rng.choice(len(corpus), size=min(args.queries, len(corpus)), replace=False)]
+        queries = perturbed(picks, 1, args.noise, rng)
+    else:
+        corpus = load_corpus(args.index_path)
+        queries = load_queries(QUERIES_PATH, args.queries)
+    corpus = np.vstack([corpus, perturbed(corpus, args.scale - 1, args.noise, rng)])
+    faiss.omp_set_num_threads(1)  # One query at a time, like a request thread
+
+    flat = build_index(corpus, "flat")
+    truth, _, _ = run_queries(flat, queries, args.k)
+
+    rows = []
+    for index_type in args.types.split(","):
+        # What is actually built: small corpora fall back to a simpler type
+        factory = factory_string(index_type, len(corpus), corpus.shape[1])
+        started = time.perf_counter()
+        index = build_index(corpus, index_type, factory)
+        build_seconds = time.perf_counter() - started
+        if index_type in ("ivf", "ivfpq"):
+            settings = [("nprobe", int(v)) for v in args.nprobe.split(",")]
+        elif index_type == "hnsw":
+            settings = [("efSearch", int(v)) for v in args.ef_search.split(",")]
+        else:
+            settings = [("", None)]
+        for name, value in settings:
+            apply_search_params(index, nprobe=value if name == "nprobe" else None,
+                                ef_search=value if name == "efSearch" else None)
+            results, p50, p95 = run_queries(index, queries, args.k)
+            rows.append({
+                "type": index_type,
+                "factory": factory,
+                "param": f"{name}={value}" if name else "-",
+                "recall": recall(results, truth, args.k),
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "mb": index_bytes(index) / 1e6,
+                "build_s": build_seconds,
+            })
+
+    print("\n=== Index Benchmark ===")
+    print(f"{len(corpus)} vectors x {corpus.shape[1]} dims, {len(queries)} queries, recall@{args.k} vs flat")
+    print(f"{'type':<7} {'factory':<16} {'param':<13} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'size MB':>9} {'build s':>8}")
+    for r in rows:
+        print(f"{r['type']:<7} {r['factory']:<16} {r['param']:<13} {r['recall']:>7.3f} {r['p50_ms']:>8.3f} "
+              f"{r['p95_ms']:>8.3f} {r['mb']:>9.1f} {r['build_s']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Offline throughput benchmark for the ingestion pipeline.
+
+Builds a throwaway index from the PDFs in data/ using the fake embedding backend
+(simulated network latency, no API key or quota needed), once serially and once
+with the parallel/batched pipeline settings, and prints the timings.
+
+    python benchmark_ingest.py --latency 0.3 --workers 4 --batch-size 64 --concurrency 4
+"""
+import argparse
+import tempfile
+
+from embedding_backends import FakeEmbeddings, FAKE_EMBEDDING_SIZE
+from ingest_data import ingest_data, DATA_DIR, INGEST_WORKERS, EMBED_BATCH_SIZE, EMBED_CONCURRENCY
+
+def run(label, embeddings, data_dir, workers, batch_size, concurrency):
+    with tempfile.TemporaryDirectory() as index_path:
+        summary = ingest_data(full_rebuild=True, embeddings=embeddings, data_dir=data_dir,
+                              index_path=index_path, workers=workers, batch_size=batch_size,
+                              concurrency=concurrency)
+    if not summary:
+        print(f"{label}: nothing ingested.")
+        return None
+    rate = summary["chunks_added"] / summary["elapsed"] if summary["elapsed"] else 0
+    return {
+        "label": label,
+        "settings": f"workers={workers} batch={batch_size} concurrency={concurrency}",
+        "chunks": summary["chunks_added"],
+        "batches": summary["batches"],
+        "seconds": round(summary["elapsed"], 2),
+        "chunks_per_second": round(rate, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion pipeline with fake embeddings.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--latency", type=float, default=0.3, help="Simulated seconds per embedding request.")
+    parser.add_argument("--per-text-latency", type=float, default=0.002, help="Simulated seconds per embedded chunk.")
+    parser.add_argument("--size", type=int, default=FAKE_EMBEDDING_SIZE, help="Embedding dimension.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY)
+    parser.add_argument("--serial-batch-size", type=int, default=16,
+                        help="Batch size for the serial baseline run.")
+    args = parser.parse_args()
+
+    embeddings = FakeEmbeddings(size=args.size, latency=args.latency, per_text_latency=args.per_text_latency)
+
+    results = [
+        run("serial", embeddings, args.data_dir, 1, args.serial_batch_size, 1),
+        run("pipelined", embeddings, args.data_dir, args.workers, args.batch_size, args.concurrency),
+    ]
+
+    print("\n=== Ingestion Benchmark ===")
+    print(f"Fake embeddings: {args.latency}s/request + {args.per_text_latency}s/chunk, dim={args.size}")
+    for r in results:
+        if r:
+            print(f"{r['label']:<10} {r['settings']:<40} {r['chunks']} chunks, {r['batches']} batches, "
+                  f"{r['seconds']}s ({r['chunks_per_second']} chunks/s)")
+
+if __name__ == "__main__":
+    main()
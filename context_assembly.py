@@ -0,0 +1,164 @@
+# context_assembly.py
+"""
+Builds the knowledge-base context that lookup_guides hands to the agent.
+
+Retrieval fetches a few more candidate chunks than are sent. The splitter in
+ingest_data.py overlaps neighbouring chunks by 200 characters, so hits from the
+same page often repeat text. The assembler:
+
+1. drops exact duplicates and chunks already contained in another hit,
+2. merges overlapping or adjacent chunks of the same source and page into one passage,
+3. packs passages, best relevance first, into CONTEXT_TOKEN_BUDGET estimated tokens.
+"""
+import os
+import re
+
+from langchain_core.documents import Document
+
+# --- CONFIGURATION ---
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # Per lookup_guides result
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))  # Chunks retrieved before assembly
+
+MAX_CHUNK_OVERLAP = 250  # Splitter overlap is 200; allow for whitespace trimming
+MIN_TEXT_OVERLAP = 20  # Shorter suffix/prefix matches are treated as coincidence
+ADJACENT_GAP = 2  # Characters between chunk spans still counted as adjacent
+
+
+def estimate_tokens(text):
+    return len(text) // 4  # Rough average for English text
+
+
+def relevance(distance):
+    """Maps a FAISS L2 distance to a 0-1 relevance score (higher is better)."""
+    return round(1.0 / (1.0 + float(distance)), 4)
+
+
+def _normalise(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _text_overlap(left, right):
+    """Length of the longest suffix of `left` that is a prefix of `right`."""
+    for size in range(min(len(left), len(right), MAX_CHUNK_OVERLAP), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class Passage:
+    __slots__ = ("text", "source", "page", "score", "start", "end", "chunks")
+
+    def __init__(self, doc, score):
+        self.text = doc.page_content
+        self.source = doc.metadata.get("source", "Unknown")
+        self.page = doc.metadata.get("page")
+        self.score = score
+        self.start = doc.metadata.get("start_index")
+        self.end = self.start + len(self.text) if self.start is not None else None
+        self.chunks = 1
+
+    def absorb(self, other, text):
+        self.text = text
+        self.score = max(self.score, other.score)
+        self.chunks += other.chunks
+        if self.start is not None and other.start is not None:
+            self.start, self.end = min(self.start, other.start), max(self.end, other.end)
+        else:
+            self.start = self.end = None
+
+    def to_document(self):
+        metadata = {"source": self.source, "score": self.score, "chunks": self.chunks}
+        if self.page is not None:
+            metadata["page"] = self.page
+        return Document(page_content=self.text, metadata=metadata)
+
+
+def _merged_text(a, b):
+    """Text of a and b joined if they overlap or touch, else None."""
+    if a.text in b.text:
+        return b.text
+    if b.text in a.text:
+        return a.text
+    if a.start is not None and b.start is not None:
+        first, second = (a, b) if a.start <= b.start else (b, a)
+        if second.start <= first.end:
+            return first.text + second.text[first.end - second.start:]
+        if second.start - first.end <= ADJACENT_GAP:
+            return first.text + " " + second.text
+        return None
+    overlap = _text_overlap(a.text, b.text)
+    if overlap:
+        return a.text + b.text[overlap:]
+    overlap = _text_overlap(b.text, a.text)
+    if overlap:
+        return b.text + a.text[overlap:]
+    return None
+
+
+def _merge_group(passages):
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(passages)):
+            for j in range(i + 1, len(passages)):
+                text = _merged_text(passages[i], passages[j])
+                if text is not None:
+                    passages[i].absorb(passages[j], text)
+                    del passages[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return passages
+
+
+def assemble_context(results, budget=None):
+    """
+    `results` is [(Document, relevance 0-1)] as returned by VectorStoreService.search.
+    Returns the packed passages as Documents with source, page, score and chunk count in metadata.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+
+    # 1. Exact duplicates (e.g. the same answer ingested twice)
+    seen = set()
+    groups = {}
+    for doc, score in results:
+        key = _normalise(doc.page_content)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        passage = Passage(doc, score)
+        groups.setdefault((passage.source, passage.page), []).append(passage)
+
+    # 2. Overlapping / adjacent chunks of the same page
+    passages = []
+    for group in groups.values():
+        passages.extend(_merge_group(group))
+
+    # 3. Best first, within the token budget
+    passages.sort(key=lambda p: p.score, reverse=True)
+    packed, used = [], 0
+    for passage in passages:
+        tokens = estimate_tokens(passage.text)
+        if used + tokens <= budget:
+            packed.append(passage)
+            used += tokens
+        elif not packed:
+            # Never return nothing: cut the best passage down to the budget
+            passage.text = passage.text[:budget * 4]
+            packed.append(passage)
+            used = budget
+    return [p.to_document() for p in packed]
+
+
+def format_context(docs):
+    """Renders passages for the agent. 'Source: ' lines are parsed for the sources shown to the user."""
+    blocks = []
+    for doc in docs:
+        details = []
+        page = doc.metadata.get("page")
+        if page is not None:
+            details.append(f"Page: {page + 1 if isinstance(page, int) else page}")  # PDF pages are 0-based
+        details.append(f"Relevance: {doc.metadata['score']:.2f}")
+        blocks.append(f"Source: {doc.metadata['source']}\n{' | '.join(details)}\nContent: {doc.page_content}")
+    return "\n\n".join(blocks)
@@ -0,0 +1,220 @@
+# conversation_store.py
+"""
+Server-side chat history, keyed by a conversation id kept in the session cookie.
+
+The cookie only ever carries the id, so its size and signing cost stay constant however
+long a conversation gets. Each conversation keeps both roles, the last
+CONVERSATION_MAX_MESSAGES messages of at most CONVERSATION_MAX_CHARS characters each,
+and is dropped after CONVERSATION_IDLE_TTL seconds without a message. Backends
+(CONVERSATION_STORE_BACKEND):
+
+- memory: per-process LRU of at most CONVERSATION_MAX_SESSIONS conversations (default;
+          a single process, or sticky sessions).
+- sqlite: rows in `conversations.sqlite` (WAL mode), shared by worker processes on one host.
+- redis:  one list per conversation at CONVERSATION_REDIS_URL (`pip install redis`),
+          shared across hosts. Any client with the redis list commands (e.g. fakeredis)
+          can be passed to RedisConversationStore instead.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+CONVERSATION_STORE_BACKEND = os.getenv("CONVERSATION_STORE_BACKEND", "memory")
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "12"))  # Both roles
+CONVERSATION_MAX_CHARS = int(os.getenv("CONVERSATION_MAX_CHARS", "2000"))  # Per stored message
+CONVERSATION_IDLE_TTL = int(os.getenv("CONVERSATION_IDLE_TTL", str(4 * 60 * 60)))  # Seconds
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))  # memory backend
+CONVERSATION_SQLITE_PATH = os.getenv("CONVERSATION_SQLITE_PATH", os.path.join(os.getenv("EVENT_STORE_DIR", "."), "conversations.sqlite"))
+CONVERSATION_REDIS_URL = os.getenv("CONVERSATION_REDIS_URL", "redis://localhost:6379/0")
+
+SESSION_KEY = "conversation_id"
+LEGACY_SESSION_KEY = "chat_history"  # Full history in the cookie, before this store existed
+SWEEP_INTERVAL = 60  # Seconds between purges of idle conversations (sqlite)
+
+_ROLES = {"user": "u", "assistant": "a"}
+_ROLE_NAMES = {v: k for k, v in _ROLES.items()}
+
+
+def _compact(role, content):
+    return _ROLES.get(role, "a"), (content or "")[:CONVERSATION_MAX_CHARS]
+
+
+def _expand(messages):
+    return [{"role": _ROLE_NAMES[role], "content": content} for role, content in messages]
+
+
+class BaseConversationStore:
+    def history(self, conversation_id):
+        """[{'role', 'content'}, ...] oldest first; empty for unknown or expired conversations."""
+        raise NotImplementedError
+
+    def append(self, conversation_id, role, content):
+        raise NotImplementedError
+
+    def clear(self, conversation_id):
+        raise NotImplementedError
+
+
+class MemoryConversationStore(BaseConversationStore):
+    def __init__(self, max_sessions=CONVERSATION_MAX_SESSIONS, ttl=CONVERSATION_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conversations = OrderedDict()  # id -> (last message time, [(role, content), ...]), oldest first
+
+    def history(self, conversation_id):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                return []
+            if time.time() - entry[0] > self.ttl:
+                del self._conversations[conversation_id]
+                return []
+            self._conversations.move_to_end(conversation_id)
+            return _expand(entry[1])
+
+    def append(self, conversation_id, role, content):
+        with self._lock:
+            entry = self._conversations.pop(conversation_id, None)
+            messages = entry[1] if entry and time.time() - entry[0] <= self.ttl else []
+            messages.append(_compact(role, content))
+            del messages[:-CONVERSATION_MAX_MESSAGES]
+            self._conversations[conversation_id] = (time.time(), messages)
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+
+    def clear(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+
+class SqliteConversationStore(BaseConversationStore):
+    def __init__(self, path=CONVERSATION_SQLITE_PATH, ttl=CONVERSATION_IDLE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "conversation_id TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS conversation_messages_by_id ON conversation_messages (conversation_id, seq)"
+        )
+        self._conn.commit()
+
+    def history(self, conversation_id):
+        with self._conn_lock:
+            rows = self._conn.execute(
+                "SELECT role, content, created FROM conversation_messages WHERE conversation_id = ? "
+                "ORDER BY seq DESC LIMIT ?", (conversation_id, CONVERSATION_MAX_MESSAGES)
+            ).fetchall()
+        if not rows or time.time() - rows[0][2] > self.ttl:
+            return []
+        return _expand((role, content) for role, content, _ in reversed(rows))
+
+    def append(self, conversation_id, role, content):
+        now = time.time()
+        with self._conn_lock:
+            self._conn.execute(
+                "INSERT INTO conversation_messages (conversation_id, role, content, created) VALUES (?, ?, ?, ?)",
+                (conversation_id, *_compact(role, content), now)
+            )
+            # Keep only the newest CONVERSATION_MAX_MESSAGES rows of this conversation
+            self._conn.execute(
+                "DELETE FROM conversation_messages WHERE conversation_id = ? AND seq <= ("
+                "SELECT seq FROM conversation_messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (conversation_id, conversation_id, CONVERSATION_MAX_MESSAGES)
+            )
+            if now - self._last_sweep > SWEEP_INTERVAL:
+                self._last_sweep = now
+                self._conn.execute(
+                    "DELETE FROM conversation_messages WHERE conversation_id IN (SELECT conversation_id "
+                    "FROM conversation_messages GROUP BY conversation_id HAVING MAX(created) < ?)", (now - self.ttl,)
+                )
+            self._conn.commit()
+
+    def clear(self, conversation_id):
+        with self._conn_lock:
+            self._conn.execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (conversation_id,))
+            self._conn.commit()
+
+
+class RedisConversationStore(BaseConversationStore):
+    """One capped list per conversation; redis expires it after the idle TTL."""
+
+    def __init__(self, client=None, ttl=CONVERSATION_IDLE_TTL, prefix="conversation:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("CONVERSATION_STORE_BACKEND=redis requires the redis package (pip install redis).")
+            client = redis.Redis.from_url(CONVERSATION_REDIS_URL)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def history(self, conversation_id):
+        items = self.client.lrange(self.prefix + conversation_id, 0, -1)
+        return _expand(json.loads(item) for item in items)
+
+    def append(self, conversation_id, role, content):
+        key = self.prefix + conversation_id
+        pipe = self.client.pipeline()
+        pipe.rpush(key, json.dumps(_compact(role, content)))
+        pipe.ltrim(key, -CONVERSATION_MAX_MESSAGES, -1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def clear(self, conversation_id):
+        self.client.delete(self.prefix + conversation_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if CONVERSATION_STORE_BACKEND == "memory":
+                _store = MemoryConversationStore()
+            elif CONVERSATION_STORE_BACKEND == "sqlite":
+                _store = SqliteConversationStore()
+            elif CONVERSATION_STORE_BACKEND == "redis":
+                _store = RedisConversationStore()
+            else:
+                raise ValueError(
+                    f"Unknown CONVERSATION_STORE_BACKEND '{CONVERSATION_STORE_BACKEND}'. Expected 'memory', 'sqlite' or 'redis'."
+                )
+        return _store
+
+
+def session_conversation(session):
+    """
+    The conversation id of a session (Flask session or a plain dict), creating one if
+    needed. Returns (conversation_id, created); the session only needs saving when created.
+    A history still held in an old cookie is moved into the store.
+    """
+    conversation_id = session.get(SESSION_KEY)
+    legacy = session.pop(LEGACY_SESSION_KEY, None)
+    created = conversation_id is None or legacy is not None
+    if conversation_id is None:
+        conversation_id = uuid.uuid4().hex
+        session[SESSION_KEY] = conversation_id
+    if legacy:
+        store = get_conversation_store()
+        for message in legacy[-CONVERSATION_MAX_MESSAGES:]:
+            store.append(conversation_id, message.get("role"), message.get("content"))
+    return conversation_id, created
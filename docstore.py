@@ -0,0 +1,134 @@
+# docstore.py
+"""
+On-disk chunk store for the FAISS index, replacing LangChain's pickled docstore (index.pkl).
+
+`faiss_index/docstore.sqlite` holds one row per vector position: the docstore id, the
+chunk text and its metadata as JSON. Workers open it read-only and fetch chunks by id
+as search results come back, so nothing is deserialised at startup, the OS page cache
+is shared between worker processes, and loading an index no longer unpickles anything.
+
+A store keeps one connection open from construction, so it reads the file generation
+it was loaded with even after a save replaces the file on disk.
+
+Chunks added or deleted at runtime (Golden Dataset ingestion) live in an in-memory
+overlay until the store is written to a new file.
+"""
+import os
+import json
+import sqlite3
+import threading
+
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+DOCSTORE_FILE = "docstore.sqlite"
+
+_SCHEMA = "CREATE TABLE chunks (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+
+
+def _connect(path):
+    # immutable: the file is never written in place (saves replace it), so SQLite can skip locking
+    return sqlite3.connect(f"file:{os.path.abspath(path)}?immutable=1", uri=True, check_same_thread=False)
+
+
+def _document(doc_id, content, metadata):
+    return Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+
+
+class SqliteDocstore(Docstore, AddableMixin):
+    def __init__(self, path):
+        self.path = path
+        # Opened (and read) now: the open file pins this generation of the docstore
+        self._conn = _connect(path)
+        self._conn_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._added = {}
+        self._deleted = set()
+        self._conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone()
+
+    def positions(self):
+        """{vector position: docstore id} of this generation (the FAISS wrapper's index_to_docstore_id)."""
+        with self._conn_lock:
+            return dict(self._conn.execute("SELECT position, id FROM chunks ORDER BY position"))
+
+    def _stored(self, doc_id):
+        with self._conn_lock:
+            row = self._conn.execute("SELECT content, metadata FROM chunks WHERE id = ?", (doc_id,)).fetchone()
+        return _document(doc_id, *row) if row else None
+
+    def search(self, search):
+        """Document for an id, or a 'not found' string (the InMemoryDocstore contract FAISS relies on)."""
+        with self._lock:
+            if search in self._added:
+                return self._added[search]
+            if search in self._deleted:
+                return f"ID {search} not found."
+        return self._stored(search) or f"ID {search} not found."
+
+    def add(self, texts):
+        with self._lock:
+            overlapping = [doc_id for doc_id in texts
+                           if doc_id in self._added or (doc_id not in self._deleted and self._stored(doc_id))]
+            if overlapping:
+                raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+            for doc_id, doc in texts.items():
+                self._deleted.discard(doc_id)
+                self._added[doc_id] = doc
+
+    def delete(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                if self._added.pop(doc_id, None) is None:
+                    if doc_id in self._deleted or not self._stored(doc_id):
+                        raise ValueError(f"ID {doc_id} not found.")
+                    self._deleted.add(doc_id)
+
+
+def read_positions(path):
+    """{vector position: docstore id}, the FAISS wrapper's index_to_docstore_id."""
+    conn = _connect(path)
+    try:
+        return dict(conn.execute("SELECT position, id FROM chunks ORDER BY position"))
+    finally:
+        conn.close()
+
+
+def read_all(path):
+    """{id: Document} of every stored chunk, for building an in-memory docstore."""
+    conn = _connect(path)
+    try:
+        return {row[0]: _document(*row) for row in conn.execute("SELECT id, content, metadata FROM chunks")}
+    finally:
+        conn.close()
+
+
+def iter_documents(vectorstore):
+    """(id, Document) for every vector of a LangChain FAISS store, in position order, whatever its docstore."""
+    for position in sorted(vectorstore.index_to_docstore_id):
+        doc_id = vectorstore.index_to_docstore_id[position]
+        doc = vectorstore.docstore.search(doc_id)
+        if isinstance(doc, Document):
+            yield doc_id, doc
+
+
+def _rows(vectorstore):
+    for position, doc_id in sorted(vectorstore.index_to_docstore_id.items()):
+        doc = vectorstore.docstore.search(doc_id)
+        if not isinstance(doc, Document):
+            raise ValueError(f"Vector {position} has no chunk in the docstore ({doc_id}).")
+        yield position, doc_id, doc
+
+
+def write_docstore(vectorstore, path):
+    """Writes the chunks of a FAISS store to a new SQLite file at `path`."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(_SCHEMA)
+        conn.executemany(
+            "INSERT INTO chunks (position, id, content, metadata) VALUES (?, ?, ?, ?)",
+            ((position, doc_id, doc.page_content, json.dumps(doc.metadata, default=str))
+             for position, doc_id, doc in _rows(vectorstore))
+        )
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,130 @@
+# embedding_backends.py
+"""
+Embedding model backends, selected with the EMBEDDING_BACKEND setting.
+
+- google: Gemini `models/embedding-001` (remote, needs GOOGLE_API_KEY)
+- local:  a sentence-transformers model run on this machine (CPU by default), so
+          query embedding needs no network round-trip or API key
+- fake:   deterministic hash-seeded vectors with optional simulated latency,
+          for benchmarking the ingestion pipeline and running offline
+"""
+import os
+import time
+import hashlib
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# --- CONFIGURATION ---
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google")
+EMBEDDING_MODEL = "models/embedding-001"
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_DEVICE = os.getenv("LOCAL_EMBEDDING_DEVICE", "cpu")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+FAKE_EMBEDDING_SIZE = int(os.getenv("FAKE_EMBEDDING_SIZE", "768"))
+FAKE_EMBEDDING_LATENCY = float(os.getenv("FAKE_EMBEDDING_LATENCY", "0"))  # Seconds per request
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Offline stand-in for a remote embedding API.
+    The same text always maps to the same unit vector, and each call sleeps for
+    `latency` seconds (plus `per_text_latency` per input) to mimic a network round-trip.
+    """
+
+    def __init__(self, size=FAKE_EMBEDDING_SIZE, latency=FAKE_EMBEDDING_LATENCY, per_text_latency=0.0):
+        self.size = size
+        self.model_name = f"fake-{size}"
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _sleep(self, count):
+        delay = self.latency + self.per_text_latency * count
+        if delay > 0:
+            time.sleep(delay)
+
+    def embed_documents(self, texts):
+        self._sleep(len(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        self._sleep(1)
+        return self._vector(text)
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    sentence-transformers model loaded once per process and shared by all callers.
+    Vectors are L2-normalised. Inference is serialised with a lock: the model already
+    uses every core for one batch, so concurrent batches would only contend.
+    """
+    _models = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, device=LOCAL_EMBEDDING_DEVICE,
+                 batch_size=LOCAL_EMBEDDING_BATCH_SIZE):
+        self.model_name = model_name
+        self.device = device
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self.model = self._load(model_name, device)
+
+    @classmethod
+    def _load(cls, model_name, device):
+        with cls._models_lock:
+            key = (model_name, device)
+            if key not in cls._models:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError as e:
+                    raise ImportError(
+                        "EMBEDDING_BACKEND=local needs the sentence-transformers package "
+                        "(pip install sentence-transformers)."
+                    ) from e
+                cls._models[key] = SentenceTransformer(model_name, device=device)
+            return cls._models[key]
+
+    def _encode(self, texts):
+        with self._lock:
+            vectors = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                        convert_to_numpy=True, show_progress_bar=False)
+        return vectors.tolist()
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts)) if texts else []
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
+
+
+def missing_api_key(backend=None):
+    """True when `backend` (default EMBEDDING_BACKEND) needs GOOGLE_API_KEY and it is not set."""
+    return (backend or EMBEDDING_BACKEND) == "google" and not os.getenv("GOOGLE_API_KEY")
+
+
+def create_embeddings(backend=None):
+    """
+    Builds the raw (uncached) embeddings model for a backend.
+    Returns (embeddings, model_name); the model name keys the embedding cache.
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL
+    if backend == "local":
+        return LocalEmbeddings(), LOCAL_EMBEDDING_MODEL
+    if backend == "fake":
+        embeddings = FakeEmbeddings()
+        return embeddings, embeddings.model_name
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Expected 'google', 'local' or 'fake'.")
+
+
+def embedding_model_name(embeddings):
+    """Model name of an embeddings object (cached or raw), used to tag the FAISS index."""
+    return getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None)
@@ -0,0 +1,202 @@
+# embedding_cache.py
+"""
+Persistent embedding cache shared by the chat agent, the admin evaluation and ingestion.
+
+Vectors are stored in a small SQLite file keyed by model name + kind (query/document)
++ normalised text, so identical searches and unchanged chunks never hit the
+embedding API twice, even across restarts. The cache is bounded: least recently
+used rows are evicted once it grows past EMBEDDING_CACHE_MAX_ENTRIES.
+
+Lookups stay read-only: last-used times of hits are buffered and written in one batch
+every TOUCH_FLUSH_INTERVAL seconds (or TOUCH_FLUSH_SIZE hits), and the table size
+is tracked from inserts and only recounted every SIZE_CHECK_INTERVAL rows.
+"""
+import os
+import re
+import atexit
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embedding_backends import create_embeddings
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+
+TOUCH_FLUSH_INTERVAL = 30  # Seconds between writes of buffered last-used times
+TOUCH_FLUSH_SIZE = 1000  # ...or as soon as this many hits are buffered
+SIZE_CHECK_INTERVAL = 1000  # Inserted rows between exact counts (other processes insert too)
+EVICT_TO = 0.9  # Eviction trims to this fraction of the limit, so a full cache is not recounted on every insert
+
+
+def normalize_text(text, kind):
+    """Collapses whitespace; queries are also case-folded since users type them loosely."""
+    text = re.sub(r"\s+", " ", text or "").strip()
+    return text.casefold() if kind == "query" else text
+
+
+def cache_key(model, kind, normalized):
+    return hashlib.sha256(f"{model}\x00{kind}\x00{normalized}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._touched = {}  # key -> last used, not yet written
+        self._last_touch_flush = time.monotonic()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._inserted_since_count = 0
+
+    def _flush_touched(self):
+        # Caller holds the lock
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()]
+            )
+            self._conn.commit()
+            self._touched.clear()
+        self._last_touch_flush = time.monotonic()
+
+    def get_many(self, keys):
+        """Returns {key: vector} for the keys present in the cache and marks them as used."""
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):  # Stay under SQLite's variable limit
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if (len(self._touched) >= TOUCH_FLUSH_SIZE
+                        or time.monotonic() - self._last_touch_flush >= TOUCH_FLUSH_INTERVAL):
+                    self._flush_touched()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, model, items):
+        """Stores [(key, vector), ...] and evicts the least recently used rows if over the limit."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, model, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._count += len(rows)  # Upper bound: replaced keys are counted again
+            self._inserted_since_count += len(rows)
+            if self._count > self.max_entries or self._inserted_since_count >= SIZE_CHECK_INTERVAL:
+                self._flush_touched()  # Evict by up-to-date last-used times
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                self._inserted_since_count = 0
+                if self._count > self.max_entries:
+                    target = int(self.max_entries * EVICT_TO)
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                        (self._count - target,),
+                    )
+                    self._count = target
+            self._conn.commit()
+
+    def flush(self):
+        """Writes buffered last-used times (also done periodically and at exit)."""
+        with self._lock:
+            self._flush_touched()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": int(self.hits / lookups * 100) if lookups else 0,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps any LangChain embeddings model with the shared on-disk cache."""
+
+    def __init__(self, underlying, model_name, cache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model_name, "document", normalize_text(t, "document")) for t in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, new_items)
+            found.update(new_items)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text):
+        # Normalised for the key only; the model sees the question as typed
+        key = cache_key(self.model_name, "query", normalize_text(text, "query"))
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.underlying.embed_query(text)
+        self.cache.put_many(self.model_name, [(key, vector)])
+        return vector
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Process-wide cache instance (one SQLite connection per process)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+            atexit.register(_cache.flush)
+        return _cache
+
+
+def get_embeddings(backend=None):
+    """Returns the configured embeddings model (see embedding_backends) wrapped with the shared cache."""
+    underlying, model_name = create_embeddings(backend)
+    return CachedEmbeddings(underlying, model_name, get_embedding_cache())
@@ -0,0 +1,345 @@
+# evaluation_jobs.py
+"""
+Background RAGAS evaluation runs.
+
+A run sends every question of the selected dataset(s) through the production agent
+(`ask_service_desk_stream`, answer cache bypassed) on a bounded thread pool,
+recording the contexts it actually retrieved, its tool calls, steps, per-stage
+latency and token use alongside the RAGAS scores. Each answered item is checkpointed
+to `eval_runs/<run_id>/items.jsonl` and each scored item to `scores.jsonl`. If the process dies mid-run, the run is picked up again
+(skipping finished items) the next time the evaluation page is opened. Final
+results are kept per run so scores can be compared over time.
+"""
+import os
+import json
+import math
+import uuid
+import threading
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from file_lock import locked_file
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+EVAL_RUNS_DIR = os.getenv("EVAL_RUNS_DIR", "eval_runs")
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "4"))  # Questions answered in parallel
+EVAL_SCORE_BATCH = int(os.getenv("EVAL_SCORE_BATCH", "10"))  # Items per RAGAS call (scoring checkpoint size)
+
+SYNTHETIC_DATASET_FILE = 'synthetic_dataset.json'
+GOLDEN_DATASET_FILE = 'golden_dataset.json'
+METRICS = ("faithfulness", "answer_relevancy", "context_precision")
+
+ACTIVE_STATUSES = ("queued", "answering", "scoring")
+
+# Production agent, bypassing the answer cache; non-streaming so each LLM step is timed as one call
+AGENT_SETTINGS = {"collect_metrics": True, "use_cache": False, "stream": False}
+
+_threads = {}
+_threads_lock = threading.Lock()
+_resumed = False
+
+
+# --- Storage helpers ---
+
+def _run_dir(run_id):
+    return os.path.join(EVAL_RUNS_DIR, run_id)
+
+def _read_json(path, default=None):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return default
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+def _read_jsonl(path):
+    records = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass  # Torn write from a crash; the item will be redone
+    return records
+
+def _append_jsonl(path, record):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+
+def load_meta(run_id):
+    return _read_json(os.path.join(_run_dir(run_id), "meta.json"))
+
+def _save_meta(meta):
+    meta["updated_at"] = datetime.now().isoformat()
+    _write_json(os.path.join(_run_dir(meta["run_id"]), "meta.json"), meta)
+
+
+# --- Datasets ---
+
+def load_dataset(name):
+    """Returns [{'question', 'ground_truth', 'dataset'}] for 'synthetic', 'golden' or 'all'."""
+    items = []
+    if name in ("synthetic", "all"):
+        for item in _read_json(SYNTHETIC_DATASET_FILE, []):
+            items.append({"question": item["question"], "ground_truth": item["ground_truth"], "dataset": "synthetic"})
+    if name in ("golden", "all"):
+        for item in _read_json(GOLDEN_DATASET_FILE, []):
+            if item.get("question") and item.get("ground_truth"):
+                items.append({"question": item["question"], "ground_truth": item["ground_truth"], "dataset": "golden"})
+    return items
+
+
+# --- Pipeline ---
+
+class EvaluationRun:
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.dir = _run_dir(run_id)
+        self.items_path = os.path.join(self.dir, "items.jsonl")
+        self.scores_path = os.path.join(self.dir, "scores.jsonl")
+        self._checkpoint_lock = threading.Lock()
+        self.agent = None
+        self.llm = None
+        self.embeddings = None
+
+    def _init_clients(self):
+        # The production agent and its clients; evaluation drives the same loop the chat uses
+        import service_desk_bot
+
+        service_desk_bot.ensure_clients()
+        if service_desk_bot.llm is None:
+            raise RuntimeError("LLM not initialized. Check GOOGLE_API_KEY.")
+        self.agent = service_desk_bot
+        self.llm = service_desk_bot.llm
+        self.embeddings = service_desk_bot.embeddings
+
+    def answer(self, item):
+        """Runs the question through ask_service_desk_stream and captures what the agent actually did."""
+        answer, metrics = None, None
+        for event in self.agent.ask_service_desk_stream(item["question"], [], AGENT_SETTINGS):
+            if event["type"] == "answer":
+                answer = event
+            elif event["type"] == "metrics":
+                metrics = event
+            elif event["type"] == "error":
+                raise RuntimeError(event["content"])
+        if answer is None or metrics is None:
+            raise RuntimeError("Agent finished without an answer.")
+        return {
+            "answer": answer["content"],
+            "contexts": metrics["contexts"],
+            "needs_email_support": answer.get("needs_email_support", False),
+            "steps": metrics["steps"],
+            "tool_calls": metrics["tool_calls"],
+            "latency": metrics["latency"],
+            "tokens": metrics["tokens"],
+        }
+
+    def execute(self):
+        """Runs (or resumes) the run. Holds a per-run file lock so only one process works on it."""
+        try:
+            with locked_file(os.path.join(self.dir, ".lock"), blocking=False):
+                self._execute()
+        except BlockingIOError:
+            logger.info("Evaluation run %s is being processed by another worker.", self.run_id)
+        except Exception as e:
+            logger.error("Evaluation run %s failed: %s", self.run_id, e)
+            meta = load_meta(self.run_id)
+            meta["status"] = "failed"
+            meta["error"] = str(e)
+            _save_meta(meta)
+
+    def _execute(self):
+        meta = load_meta(self.run_id)
+        test_data = _read_json(os.path.join(self.dir, "dataset.json"), [])
+        self._init_clients()
+
+        # 1. Answer every question not already checkpointed
+        done = {r["index"] for r in _read_jsonl(self.items_path)}
+        todo = [(i, item) for i, item in enumerate(test_data) if i not in done]
+        meta.update(status="answering", answered=len(done), error=None)
+        _save_meta(meta)
+        logger.info("Evaluation %s: answering %d of %d items...", self.run_id, len(todo), len(test_data))
+
+        errors = 0
+        with ThreadPoolExecutor(max_workers=max(1, EVAL_CONCURRENCY)) as pool:
+            futures = {pool.submit(self.answer, item): (i, item) for i, item in todo}
+            for future in as_completed(futures):
+                i, item = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors += 1
+                    logger.error("Evaluation item %d failed: %s", i, e)
+                    continue
+                with self._checkpoint_lock:
+                    _append_jsonl(self.items_path, {"index": i, **item, **result})
+                    meta["answered"] += 1
+                    _save_meta(meta)
+
+        if errors:
+            raise RuntimeError(f"{errors} questions could not be answered; click Resume to retry them "
+                               "(answered questions are kept).")
+
+        # 2. Score in batches, checkpointing per item
+        items = {r["index"]: r for r in _read_jsonl(self.items_path)}
+        scored = {r["index"] for r in _read_jsonl(self.scores_path)}
+        pending = [items[i] for i in sorted(items) if i not in scored]
+        meta.update(status="scoring", scored=len(scored))
+        _save_meta(meta)
+
+        for start in range(0, len(pending), EVAL_SCORE_BATCH):
+            batch = pending[start:start + EVAL_SCORE_BATCH]
+            for record in self._score(batch):
+                _append_jsonl(self.scores_path, record)
+            meta["scored"] += len(batch)
+            _save_meta(meta)
+
+        # 3. Persist the run's results
+        results = summarise(_read_jsonl(self.scores_path))
+        _write_json(os.path.join(self.dir, "results.json"), results)
+        meta.update(status="completed", completed_at=datetime.now().isoformat(),
+                    scores={m: results[m] for m in METRICS}, cost=results["cost"])
+        _save_meta(meta)
+        logger.info("Evaluation %s completed.", self.run_id)
+
+    def _score(self, batch):
+        from datasets import Dataset
+        from ragas import evaluate
+        from ragas.metrics import faithfulness, answer_relevancy, context_precision
+
+        dataset = Dataset.from_dict({
+            "question": [r["question"] for r in batch],
+            "answer": [r["answer"] for r in batch],
+            "contexts": [r["contexts"] for r in batch],
+            "ground_truth": [[r["ground_truth"]] for r in batch],
+        })
+        results = evaluate(
+            dataset=dataset,
+            metrics=[faithfulness, answer_relevancy, context_precision],
+            llm=self.llm,
+            embeddings=self.embeddings
+        )
+        rows = results.to_pandas().to_dict(orient='records')
+        scored = []
+        for record, row in zip(batch, rows):
+            scored.append({
+                "index": record["index"],
+                "question": record["question"],
+                "dataset": record.get("dataset"),
+                **{m: _clean(row.get(m)) for m in METRICS},
+                # Cost side of the tradeoff, next to the quality scores
+                "steps": record.get("steps"),
+                "tool_calls": len(record.get("tool_calls") or []),
+                "latency": record.get("latency"),
+                "tokens": record.get("tokens"),
+            })
+        return scored
+
+
+def _clean(value):
+    """NaN/None scores (e.g. RAGAS parse failures) are stored as None."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else 0
+
+def summarise(score_records):
+    score_records = sorted(score_records, key=lambda r: r["index"])
+    results = {m: _mean(r.get(m) for r in score_records) for m in METRICS}
+    results["cost"] = {
+        "avg_steps": round(_mean(r.get("steps") for r in score_records), 2),
+        "avg_tool_calls": round(_mean(r.get("tool_calls") for r in score_records), 2),
+        "avg_latency": round(_mean((r.get("latency") or {}).get("total") for r in score_records), 2),
+        "avg_llm_latency": round(_mean((r.get("latency") or {}).get("llm") for r in score_records), 2),
+        "avg_retrieval_latency": round(_mean((r.get("latency") or {}).get("retrieval") for r in score_records), 3),
+        "avg_tokens": round(_mean(sum((r.get("tokens") or {}).values()) for r in score_records)),
+    }
+    # Missing scores shown as 0, as before
+    results["details"] = [{
+        "question": r["question"],
+        **{m: r.get(m) or 0 for m in METRICS},
+        "steps": r.get("steps"),
+        "tool_calls": r.get("tool_calls"),
+        "latency": (r.get("latency") or {}).get("total"),
+    } for r in score_records]
+    return results
+
+
+# --- Public API ---
+
+def _spawn(run_id):
+    with _threads_lock:
+        thread = _threads.get(run_id)
+        if thread and thread.is_alive():
+            return
+        thread = threading.Thread(target=EvaluationRun(run_id).execute, name=f"eval-{run_id}", daemon=True)
+        _threads[run_id] = thread
+        thread.start()
+
+def start_run(dataset="all"):
+    test_data = load_dataset(dataset)
+    if not test_data:
+        raise FileNotFoundError("No evaluation data found. Please generate the synthetic dataset first.")
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+    os.makedirs(_run_dir(run_id), exist_ok=True)
+    _write_json(os.path.join(_run_dir(run_id), "dataset.json"), test_data)
+    _save_meta({
+        "run_id": run_id,
+        "dataset": dataset,
+        "status": "queued",
+        "total": len(test_data),
+        "answered": 0,
+        "scored": 0,
+        "created_at": datetime.now().isoformat(),
+    })
+    _spawn(run_id)
+    return load_meta(run_id)
+
+def resume_incomplete_runs():
+    """Restarts runs interrupted by a crash or restart. Runs once per process."""
+    global _resumed
+    with _threads_lock:
+        if _resumed:
+            return
+        _resumed = True
+    for meta in list_runs():
+        if meta.get("status") in ACTIVE_STATUSES:
+            logger.info("Resuming evaluation run %s...", meta['run_id'])
+            _spawn(meta["run_id"])
+
+def retry_run(run_id):
+    meta = load_meta(run_id)
+    if meta and meta.get("status") == "failed":
+        meta["status"] = "queued"
+        _save_meta(meta)
+        _spawn(run_id)
+    return meta
+
+def list_runs():
+    if not os.path.exists(EVAL_RUNS_DIR):
+        return []
+    runs = [load_meta(run_id) for run_id in os.listdir(EVAL_RUNS_DIR)]
+    return sorted([r for r in runs if r], key=lambda r: r.get("created_at", ""), reverse=True)
+
+def get_run(run_id):
+    meta = load_meta(run_id)
+    if meta and meta.get("status") == "completed":
+        meta["results"] = _read_json(os.path.join(_run_dir(run_id), "results.json"))
+    return meta
@@ -0,0 +1,319 @@
+# event_store.py
+"""
+Append-only event stores for the query log, chat feedback and app feedback.
+
+Request handlers call `append(record)`, which only enqueues the record; a background
+thread writes the queue out in one batch every EVENT_FLUSH_INTERVAL seconds, so
+logging cost is constant no matter how much history is kept. Two backends are available (EVENT_STORE_BACKEND):
+
+- jsonl:  one JSON object per line in `<name>.jsonl`, appended under an exclusive
+          file lock so several worker processes never interleave or lose records.
+- sqlite: rows in `events.sqlite` (WAL mode), safe for concurrent processes.
+
+The legacy `<name>.json` arrays are migrated once, the first time a store is opened.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+import logging
+
+from file_lock import locked_file
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+EVENT_STORE_BACKEND = os.getenv("EVENT_STORE_BACKEND", "jsonl")
+EVENT_STORE_DIR = os.getenv("EVENT_STORE_DIR", ".")
+EVENT_SQLITE_PATH = os.path.join(EVENT_STORE_DIR, "events.sqlite")
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "0.5"))  # Seconds; 0 writes synchronously
+
+QUERY_LOG = "query_log"
+FEEDBACK_LOG = "feedback_log"
+APP_FEEDBACK = "app_feedback"
+
+
+class BaseEventStore:
+    """Queues appends and writes them from a background thread in batches."""
+
+    def __init__(self, name, flush_interval=EVENT_FLUSH_INTERVAL):
+        self.name = name
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name=f"event-flush-{name}", daemon=True)
+            self._flusher.start()
+
+    def append(self, record):
+        if self._flusher is None:
+            with self._write_lock:
+                self._write_batch([record])
+        else:
+            self._queue.put(record)
+
+    def flush(self):
+        """Writes everything queued so far (runs periodically, before reads and at exit)."""
+        with self._write_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Failed to flush %s events: %s", self.name, e)
+
+    # --- Backend interface ---
+
+    def _write_batch(self, records):
+        raise NotImplementedError
+
+    def read_all(self):
+        raise NotImplementedError
+
+    def delete_where(self, predicate):
+        """Removes records for which predicate(record) is true. Returns the number removed."""
+        raise NotImplementedError
+
+    def is_empty(self):
+        raise NotImplementedError
+
+    def read_since(self, cursor):
+        """
+        Incremental read for consumers that maintain derived data (analytics rollups).
+        Returns (records, new_cursor, reset). `reset` is True when records were deleted
+        since `cursor` was issued; the records then start from the beginning and the
+        consumer must rebuild.
+        """
+        raise NotImplementedError
+
+
+class JsonlEventStore(BaseEventStore):
+    """
+    With `max_bytes`, a file that has grown past it is renamed to `<name>.jsonl.1`
+    (replacing the previous one) before the next write, so at most two files are kept.
+    """
+
+    def __init__(self, name, directory=EVENT_STORE_DIR, max_bytes=None, **kwargs):
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self.rotated_path = self.path + ".1"
+        self.lock_path = self.path + ".lock"
+        self.max_bytes = max_bytes
+        super().__init__(name, **kwargs)
+
+    def _write_batch(self, records):
+        data = "".join(json.dumps(r) + "\n" for r in records)
+        with locked_file(self.lock_path):
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.rotated_path)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+
+    def _read_unlocked(self):
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning("Skipping corrupt line in %s", self.path)
+        return records
+
+    def read_all(self):
+        self.flush()
+        with locked_file(self.lock_path, shared=True):
+            return self._read_unlocked()
+
+    def delete_where(self, predicate):
+        self.flush()
+        with self._write_lock, locked_file(self.lock_path):
+            records = self._read_unlocked()
+            kept = [r for r in records if not predicate(r)]
+            removed = len(records) - len(kept)
+            if removed:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(r) + "\n" for r in kept))
+                os.replace(tmp_path, self.path)
+            return removed
+
+    def is_empty(self):
+        return not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+
+    def read_since(self, cursor):
+        self.flush()
+        with locked_file(self.lock_path, shared=True):
+            if not os.path.exists(self.path):
+                return [], {"generation": None, "offset": 0}, bool(cursor and cursor.get("offset"))
+            generation = os.stat(self.path).st_ino
+            records = []
+            previous = cursor.get("generation") if cursor else None
+            if previous not in (None, generation) and previous == self._rotated_generation():
+                # Rotated since the cursor was taken: finish the previous file, then start this one
+                records, _ = self._read_lines(self.rotated_path, cursor["offset"])
+                cursor = {"generation": generation, "offset": 0}
+            # Deletes replace the file, so any other new inode means earlier offsets are invalid
+            reset = not cursor or cursor.get("generation") != generation
+            new_records, offset = self._read_lines(self.path, 0 if reset else cursor["offset"])
+            records.extend(new_records)
+            return records, {"generation": generation, "offset": offset}, reset and bool(cursor)
+
+    def _rotated_generation(self):
+        try:
+            return os.stat(self.rotated_path).st_ino
+        except OSError:
+            return None
+
+    def _read_lines(self, path, offset):
+        """Complete records of `path` from byte `offset`; returns (records, offset after them)."""
+        records = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partially written line; pick it up next time
+                offset += len(line)
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    if line.strip():
+                        logger.warning("Skipping corrupt line in %s", path)
+        return records, offset
+
+
+class SqliteEventStore(BaseEventStore):
+    def __init__(self, name, path=EVENT_SQLITE_PATH, **kwargs):
+        self.path = path
+        self.table = name
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn_lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)")
+        # Bumped on every delete so incremental readers know to rebuild
+        self._conn.execute("CREATE TABLE IF NOT EXISTS store_generations (name TEXT PRIMARY KEY, generation INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO store_generations (name, generation) VALUES (?, 0)", (self.table,))
+        self._conn.commit()
+        super().__init__(name, **kwargs)
+
+    def _write_batch(self, records):
+        with self._conn_lock:
+            self._conn.executemany(f"INSERT INTO {self.table} (data) VALUES (?)", [(json.dumps(r),) for r in records])
+            self._conn.commit()
+
+    def read_all(self):
+        self.flush()
+        with self._conn_lock:
+            rows = self._conn.execute(f"SELECT data FROM {self.table} ORDER BY id").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def delete_where(self, predicate):
+        self.flush()
+        with self._write_lock, self._conn_lock:
+            rows = self._conn.execute(f"SELECT id, data FROM {self.table}").fetchall()
+            doomed = [(row_id,) for row_id, data in rows if predicate(json.loads(data))]
+            if doomed:
+                self._conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", doomed)
+                self._conn.execute(
+                    "UPDATE store_generations SET generation = generation + 1 WHERE name = ?", (self.table,)
+                )
+                self._conn.commit()
+            return len(doomed)
+
+    def read_since(self, cursor):
+        self.flush()
+        with self._conn_lock:
+            generation = self._conn.execute(
+                "SELECT generation FROM store_generations WHERE name = ?", (self.table,)
+            ).fetchone()[0]
+            reset = not cursor or cursor.get("generation") != generation
+            last_id = 0 if reset else cursor["last_id"]
+            rows = self._conn.execute(
+                f"SELECT id, data FROM {self.table} WHERE id > ? ORDER BY id", (last_id,)
+            ).fetchall()
+        if rows:
+            last_id = rows[-1][0]
+        return [json.loads(data) for _, data in rows], {"generation": generation, "last_id": last_id}, reset and bool(cursor)
+
+    def is_empty(self):
+        with self._conn_lock:
+            return self._conn.execute(f"SELECT 1 FROM {self.table} LIMIT 1").fetchone() is None
+
+
+def migrate_legacy(store, legacy_path):
+    """
+    One-shot import of a legacy JSON array file into an empty store.
+    The legacy file is left in place; a marker file prevents a second import.
+    """
+    marker = f"{legacy_path}.migrated-{EVENT_STORE_BACKEND}"
+    if not os.path.exists(legacy_path) or os.path.exists(marker):
+        return 0
+    with locked_file(legacy_path + ".lock"):
+        if os.path.exists(marker):  # Another worker migrated while we waited
+            return 0
+        try:
+            with open(legacy_path, "r") as f:
+                records = json.load(f)
+        except json.JSONDecodeError:
+            records = []
+        if records and store.is_empty():
+            store._write_batch(records)
+            logger.info("Migrated %d records from %s to the %s event store.", len(records), legacy_path, store.name)
+        else:
+            records = []
+        with open(marker, "w") as f:
+            f.write(f"{len(records)} records migrated\n")
+        return len(records)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name):
+    """Returns the process-wide store for `name`, migrating `<name>.json` on first use."""
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            if EVENT_STORE_BACKEND == "sqlite":
+                store = SqliteEventStore(name)
+            elif EVENT_STORE_BACKEND == "jsonl":
+                store = JsonlEventStore(name)
+            else:
+                raise ValueError(f"Unknown EVENT_STORE_BACKEND '{EVENT_STORE_BACKEND}'. Expected 'jsonl' or 'sqlite'.")
+            migrate_legacy(store, os.path.join(EVENT_STORE_DIR, f"{name}.json"))
+            _stores[name] = store
+        return store
+
+
+@atexit.register
+def _flush_all():
+    for store in list(_stores.values()):
+        try:
+            store.flush()
+        except Exception as e:
+            logger.error("Failed to flush %s events at exit: %s", store.name, e)
+
+
+if __name__ == "__main__":
+    # One-shot migration: python event_store.py
+    for store_name in (QUERY_LOG, FEEDBACK_LOG, APP_FEEDBACK):
+        print(f"{store_name}: {len(get_store(store_name).read_all())} records")
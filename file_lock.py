@@ -0,0 +1,34 @@
+# file_lock.py
+"""
+Cross-process advisory file locks (fcntl on POSIX).
+On platforms without fcntl the lock is a no-op and only in-process locking applies.
+"""
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextmanager
+def locked_file(lock_path, shared=False, blocking=True):
+    """
+    Holds an exclusive (or shared) lock on `lock_path` for the duration of the block.
+    With blocking=False, raises BlockingIOError if another process holds the lock.
+    """
+    directory = os.path.dirname(lock_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(lock_path, "a") as handle:
+        if fcntl is not None:
+            flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            fcntl.flock(handle.fileno(), flags)
+        try:
+            yield handle
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,82 @@
+# index_layout.py
+"""
+On-disk layout of the knowledge base index.
+
+Each save writes a complete set of files (index.faiss, docstore.sqlite, embedding.json)
+to a new directory under `<index>/versions/` and then publishes it by atomically
+replacing the one-line pointer file `<index>/CURRENT`. A reader resolves the pointer
+once and opens every file from that directory, so the vectors and the chunks it loads
+always come from the same save. Indexes saved before versioning keep their files
+directly in `<index>/` (no CURRENT file) and are read from there until the next save.
+
+The previous version is kept for readers that resolved the pointer just before it
+moved; older versions are deleted (processes that still map them keep their open files).
+"""
+import os
+import time
+import shutil
+import tempfile
+
+from docstore import DOCSTORE_FILE
+
+INDEX_FILE = "index.faiss"
+INDEX_MODEL_FILE = "embedding.json"
+INDEX_FILES = (INDEX_FILE, DOCSTORE_FILE)
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+KEEP_VERSIONS = 2
+# Files of an unversioned index, removed once it has been saved as a version
+FLAT_FILES = INDEX_FILES + (INDEX_MODEL_FILE, "index.pkl")
+
+
+def _current_version(index_path):
+    try:
+        with open(os.path.join(index_path, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def current_dir(index_path):
+    """Directory holding the files of the published index."""
+    version = _current_version(index_path)
+    return os.path.join(index_path, VERSIONS_DIR, version) if version else index_path
+
+
+def index_fingerprint(index_path):
+    """Published version and (mtime, size, inode) of its files; changes whenever the index is saved."""
+    directory = current_dir(index_path)
+    files = []
+    for name in INDEX_FILES:
+        try:
+            stat = os.stat(os.path.join(directory, name))
+            files.append((name, stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        except OSError:
+            files.append((name, None, None, None))
+    return (_current_version(index_path), tuple(files))
+
+
+def new_version_dir(index_path):
+    """Empty directory for the files of the next version (published with publish_version)."""
+    versions = os.path.join(index_path, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    # Names sort in save order, so pruning can keep the newest
+    return tempfile.mkdtemp(prefix=f"{time.time_ns():020d}-", dir=versions)
+
+
+def publish_version(index_path, version_dir):
+    """Makes `version_dir` the current index in one atomic step, then removes stale files."""
+    pointer = os.path.join(index_path, CURRENT_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(os.path.basename(version_dir) + "\n")
+    os.replace(pointer + ".tmp", pointer)
+
+    for name in FLAT_FILES:
+        try:
+            os.remove(os.path.join(index_path, name))
+        except FileNotFoundError:
+            pass
+    versions = os.path.join(index_path, VERSIONS_DIR)
+    for stale in sorted(os.listdir(versions))[:-KEEP_VERSIONS]:
+        if stale != os.path.basename(version_dir):
+            shutil.rmtree(os.path.join(versions, stale), ignore_errors=True)
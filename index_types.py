@@ -0,0 +1,140 @@
+# index_types.py
+"""
+FAISS index types for the knowledge base, chosen at ingestion time with INDEX_TYPE.
+
+- flat:  exact search (default). Memory and search time grow linearly with the corpus.
+- ivf:   vectors bucketed into k-means lists; a search scans INDEX_NPROBE lists.
+- hnsw:  navigable small-world graph; INDEX_EF_SEARCH trades recall for speed.
+- ivfpq: IVF over product-quantised codes (INDEX_PQ_M bytes per vector instead of 4 * dims).
+- sq8:   exhaustive search over 8-bit scalar-quantised vectors (4x smaller than flat).
+
+Ingestion always edits a flat index (exact vectors, supports deletes) and converts it
+just before saving. ivf and hnsw keep exact vectors, so the next incremental run
+converts them back losslessly; quantised indexes (ivfpq, sq8) do not, so ingestion
+rebuilds them from re-embedded chunks (served by the embedding cache).
+Search parameters are applied when the index is loaded, so they can be tuned without
+re-ingesting.
+"""
+import os
+import math
+import logging
+
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "sq8")
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+INDEX_NLIST = int(os.getenv("INDEX_NLIST", "0"))  # IVF lists; 0 = 4 * sqrt(vectors)
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))  # IVF lists scanned per search
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))  # Graph neighbours per vector
+INDEX_EF_CONSTRUCTION = int(os.getenv("INDEX_EF_CONSTRUCTION", "80"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))  # HNSW candidates kept per search
+INDEX_PQ_M = int(os.getenv("INDEX_PQ_M", "0"))  # PQ sub-quantisers (bytes per vector); 0 = dims / 16
+
+MIN_POINTS_PER_LIST = 39  # FAISS k-means needs this many training vectors per centroid
+PQ_CENTROIDS = 256  # 8-bit codes
+
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+
+def is_lossy(index_type):
+    """Quantised indexes cannot give back the exact vectors they were built from."""
+    return index_type in ("ivfpq", "sq8")
+
+
+def _nlist(count):
+    wanted = INDEX_NLIST or int(4 * math.sqrt(count))
+    return max(1, min(wanted, count // MIN_POINTS_PER_LIST))
+
+
+def _pq_m(dimension):
+    target = INDEX_PQ_M or max(1, dimension // 16)
+    # Sub-quantisers must divide the dimension
+    return max(m for m in range(1, target + 1) if dimension % m == 0)
+
+
+def factory_string(index_type, count, dimension):
+    """FAISS index_factory description for `count` vectors, falling back when there is too little training data."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown INDEX_TYPE '{index_type}'. Expected one of {', '.join(INDEX_TYPES)}.")
+    if index_type in ("ivf", "ivfpq") and count < MIN_POINTS_PER_LIST * 2:
+        logger.warning("Only %d vectors, using a flat index instead of %s.", count, index_type)
+        return "Flat"
+    if index_type == "ivfpq" and count < PQ_CENTROIDS * MIN_POINTS_PER_LIST:
+        logger.warning("Only %d vectors, too few to train PQ codebooks; using ivf.", count)
+        index_type = "ivf"
+    if index_type == "ivf":
+        return f"IVF{_nlist(count)},Flat"
+    if index_type == "ivfpq":
+        return f"IVF{_nlist(count)},PQ{_pq_m(dimension)}"
+    if index_type == "hnsw":
+        return f"HNSW{INDEX_HNSW_M},Flat"
+    if index_type == "sq8":
+        return "SQ8"
+    return "Flat"
+
+
+def apply_search_params(index, nprobe=None, ef_search=None):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or INDEX_NPROBE, ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search or INDEX_EF_SEARCH
+    return index
+
+
+def build_index(vectors, index_type, factory=None):
+    """
+    Trains (if needed) and fills an index of `index_type` with `vectors` (n x d float32), in order.
+    `factory` is the factory_string() already worked out for these vectors, if any.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    count, dimension = vectors.shape
+    index = faiss.index_factory(dimension, factory or factory_string(index_type, count, dimension), faiss.METRIC_L2)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = INDEX_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return apply_search_params(index)
+
+
+def index_vectors(index):
+    """All vectors of an index in position order (approximations for quantised indexes)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def to_flat(index):
+    if index_type_of(index) == "flat":
+        return index
+    flat = faiss.IndexFlatL2(index.d)
+    flat.add(index_vectors(index))
+    return flat
+
+
+def convert_index(vectorstore, index_type=None):
+    """
+    Replaces a LangChain FAISS store's index with one of `index_type`. Vector positions
+    are kept, so index_to_docstore_id stays valid.
+    """
+    index_type = index_type or INDEX_TYPE
+    if index_type == index_type_of(vectorstore.index) or vectorstore.index.ntotal == 0:
+        return vectorstore
+    vectorstore.index = build_index(index_vectors(vectorstore.index), index_type)
+    return vectorstore
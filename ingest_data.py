@@ -1,60 +1,319 @@
 import os
+import json
+import time
+import random
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from datetime import datetime
 from dotenv import load_dotenv
 from langchain_community.document_loaders import CSVLoader, PyPDFLoader
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from embedding_backends import embedding_model_name, missing_api_key
+from embedding_cache import get_embeddings, get_embedding_cache
+from file_lock import locked_file
+from index_layout import index_fingerprint
+from vector_store import atomic_save, index_exists, migrate_legacy_index, load_index, read_index_model
+from lexical_index import LexicalIndex
+from index_types import INDEX_TYPE, INDEX_TYPES, index_type_of, is_lossy, to_flat, convert_index
+
 # Load environment variables
 load_dotenv()
 
-def ingest_data():
-    documents = []
-    text_splitter = RecursiveCharacterTextSplitter(
+DATA_DIR = "data"
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index")
+# Tracks per-file content hashes and the chunk ids each file contributed to the index
+MANIFEST_FILE = "manifest.json"
+GOLDEN_SOURCE = "Golden Dataset"
+
+# --- PIPELINE CONFIGURATION ---
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))  # PDF parsing processes
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))  # Chunks per embedding request
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # Embedding requests in flight
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+
+def get_text_splitter():
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         length_function=len,
         is_separator_regex=False,
+        add_start_index=True,  # Lets lookup_guides merge overlapping neighbours exactly
+    )
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_ids_for(pdf_path, chunks):
+    """
+    Deterministic ids derived from the chunk text, so unchanged chunks of an edited
+    PDF keep their id (and vector) across runs. Repeated identical chunks get an
+    occurrence suffix to stay unique.
+    """
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        chunk_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+        ids.append(hashlib.sha256(f"{pdf_path}\x00{chunk_hash}\x00{occurrence}".encode("utf-8")).hexdigest())
+    return ids
+
+def load_manifest(index_path):
+    manifest_path = os.path.join(index_path, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print("Warning: manifest is corrupt, falling back to a full rebuild.")
+    return None
+
+def save_manifest(manifest, index_path):
+    manifest["updated_at"] = datetime.now().isoformat()
+    with open(os.path.join(index_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+def list_pdfs(data_dir):
+    if not os.path.exists(data_dir):
+        return []
+    return sorted(
+        os.path.join(data_dir, filename)
+        for filename in os.listdir(data_dir)
+        if filename.lower().endswith(".pdf")
     )
-    
-    # 1. Ingest PDF Data
-    data_dir = "data"
-    if os.path.exists(data_dir):
-        for filename in os.listdir(data_dir):
-            if filename.lower().endswith(".pdf"):
-                pdf_path = os.path.join(data_dir, filename)
-                print(f"Loading PDF data from {pdf_path}...")
+
+def load_and_split(pdf_path):
+    """Parses and splits one PDF. Runs in a worker process."""
+    loader = PyPDFLoader(pdf_path)
+    pdf_docs = loader.load()
+    # Split the documents into chunks
+    chunked_docs = get_text_splitter().split_documents(pdf_docs)
+    print(f"Loaded {len(pdf_docs)} pages from {os.path.basename(pdf_path)}, split into {len(chunked_docs)} chunks.")
+    return chunked_docs
+
+def embed_with_retry(embeddings, texts, max_retries=EMBED_MAX_RETRIES, base_delay=1.0):
+    """Embeds one batch, retrying with exponential backoff and jitter (rate limits, timeouts)."""
+    for attempt in range(max_retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) + random.uniform(0, base_delay)
+            print(f"Embedding batch of {len(texts)} failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def embed_batch(embeddings, ids, docs):
+    vectors = embed_with_retry(embeddings, [d.page_content for d in docs])
+    return ids, docs, vectors
+
+def append_batch(vectorstore, embeddings, ids, docs, vectors):
+    """Adds pre-computed vectors to the index, creating it on the first batch."""
+    text_embeddings = list(zip([d.page_content for d in docs], vectors))
+    metadatas = [d.metadata for d in docs]
+    if vectorstore is None:
+        return FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+    vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    return vectorstore
+
+def golden_documents(vectorstore):
+    """Returns (ids, documents) for Golden Dataset entries added via /admin/ingest_golden."""
+    ids, docs = [], []
+    for doc_id, doc in vectorstore.docstore._dict.items():
+        if doc.metadata.get("source") == GOLDEN_SOURCE:
+            ids.append(doc_id)
+            docs.append(doc)
+    return ids, docs
+
+def merge_new_golden(vectorstore, embeddings, index_path):
+    """Carries over golden entries that the app added to the on-disk index while we were ingesting."""
+    on_disk = load_index(index_path, embeddings, mmap=False)
+    golden_ids, golden_docs = golden_documents(on_disk)
+    new = [(i, d) for i, d in zip(golden_ids, golden_docs) if i not in vectorstore.docstore._dict]
+    if new:
+        print(f"Merging {len(new)} Golden Dataset entries added during ingestion...")
+        vectorstore.add_documents([d for _, d in new], ids=[i for i, _ in new])
+
+def ingest_data(full_rebuild=False, embeddings=None, data_dir=DATA_DIR, index_path=FAISS_INDEX_PATH,
+                workers=INGEST_WORKERS, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY,
+                index_type=INDEX_TYPE):
+    """
+    Incrementally syncs the FAISS index with the PDFs in data/.
+    Only new or changed PDFs are loaded and embedded, vectors of deleted PDFs are
+    removed, and Golden Dataset entries are always preserved.
+    With full_rebuild=True every PDF is re-processed (golden entries are kept).
+
+    Changed PDFs are parsed in a process pool; their chunks are embedded in batches
+    on a bounded thread pool and appended to the index as each batch completes.
+    The index is edited as a flat index and converted to `index_type` (see index_types) when saved.
+    Returns a summary dict (counts and timings), or None if nothing was written.
+    """
+    started = time.time()
+    if embeddings is None:
+        print("Initializing Embeddings...")
+        if missing_api_key():
+            print("Error: GOOGLE_API_KEY not found in environment variables.")
+            return None
+        # Cached embeddings: unchanged chunks are not re-embedded on re-ingestion
+        embeddings = get_embeddings()
+
+    vectorstore = None
+    if index_exists(index_path):
+        migrate_legacy_index(index_path)
+    loaded_fingerprint = index_fingerprint(index_path)
+    if index_exists(index_path):
+        vectorstore = load_index(index_path, embeddings, mmap=False)
+        tag = read_index_model(index_path)
+        if tag and tag.get("model") != embedding_model_name(embeddings):
+            # Vectors from two models cannot share an index: re-embed everything
+            print(f"Index was built with '{tag.get('model')}', now using '{embedding_model_name(embeddings)}'.")
+            full_rebuild = True
+    loaded_type = index_type_of(vectorstore.index) if vectorstore is not None else None
+    if vectorstore is not None and not full_rebuild:
+        if is_lossy(loaded_type):
+            print(f"Index is quantised ({loaded_type}); rebuilding it from exact vectors.")
+            full_rebuild = True
+        else:
+            vectorstore.index = to_flat(vectorstore.index)
+
+    manifest = None if full_rebuild else load_manifest(index_path)
+    if vectorstore is not None and manifest is None:
+        # Full rebuild, or an index built before manifests existed: drop every
+        # PDF chunk but keep the golden entries.
+        golden_ids, golden_docs = golden_documents(vectorstore)
+        print(f"Rebuilding index from scratch (preserving {len(golden_docs)} Golden Dataset entries)...")
+        vectorstore = FAISS.from_documents(golden_docs, embeddings, ids=golden_ids) if golden_docs else None
+    if manifest is None:
+        manifest = {"version": 1, "files": {}}
+
+    # 1. Work out what changed
+    pdf_paths = list_pdfs(data_dir)
+    tracked = manifest["files"]
+    removed = [path for path in tracked if path not in pdf_paths]
+
+    ids_to_delete = []
+    for path in removed:
+        print(f"Removing deleted file {path}...")
+        ids_to_delete.extend(tracked.pop(path)["chunk_ids"])
+
+    changed = {}
+    for pdf_path in pdf_paths:
+        file_hash = file_sha256(pdf_path)
+        previous = tracked.get(pdf_path)
+        if not previous or previous["sha256"] != file_hash:
+            changed[pdf_path] = file_hash
+
+    if not ids_to_delete and not changed and vectorstore is not None and loaded_type == index_type:
+        print("Index is up to date. Nothing to ingest.")
+        return None
+
+    print(f"Files to process: {len(changed)}, files removed: {len(removed)}")
+
+    # 2. Parse changed PDFs in parallel and stream their new chunks into the index
+    added = 0
+    batches = 0
+    removed_chunks = 0
+    try:
+        if ids_to_delete and vectorstore is not None:
+            vectorstore.delete(ids_to_delete)
+            removed_chunks += len(ids_to_delete)
+
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as parse_pool, \
+                ThreadPoolExecutor(max_workers=max(1, concurrency)) as embed_pool:
+            parse_futures = {parse_pool.submit(load_and_split, path): path for path in changed}
+            pending = set()
+
+            for future in as_completed(parse_futures):
+                # Dropped now so each file's parsed chunks are freed once they are batched
+                pdf_path = parse_futures.pop(future)
                 try:
-                    loader = PyPDFLoader(pdf_path)
-                    pdf_docs = loader.load()
-                    # Split the documents into chunks
-                    chunked_docs = text_splitter.split_documents(pdf_docs)
-                    print(f"Loaded {len(pdf_docs)} pages from {filename}, split into {len(chunked_docs)} chunks.")
-                    documents.extend(chunked_docs)
+                    chunks = future.result()
                 except Exception as e:
-                    print(f"Error loading PDF {filename}: {e}")
+                    print(f"Error loading PDF {os.path.basename(pdf_path)}: {e}")
+                    continue
 
-    if not documents:
-        print("No documents loaded. Exiting.")
-        return
+                previous = tracked.get(pdf_path)
+                new_ids = chunk_ids_for(pdf_path, chunks)
+                old_ids = set(previous["chunk_ids"]) if previous else set()
 
-    print(f"Total documents to ingest: {len(documents)}")
+                # Chunks whose text did not change keep their existing vectors
+                stale = list(old_ids - set(new_ids))
+                if stale and vectorstore is not None:
+                    vectorstore.delete(stale)
+                    removed_chunks += len(stale)
+                fresh = [(chunk_id, chunk) for chunk_id, chunk in zip(new_ids, chunks) if chunk_id not in old_ids]
+                tracked[pdf_path] = {"sha256": changed[pdf_path], "chunk_ids": new_ids}
 
-    print("Initializing Gemini Embeddings...")
-    if not os.getenv("GOOGLE_API_KEY"):
-        print("Error: GOOGLE_API_KEY not found in environment variables.")
-        return
+                for start in range(0, len(fresh), batch_size):
+                    batch = fresh[start:start + batch_size]
+                    pending.add(embed_pool.submit(
+                        embed_batch, embeddings, [i for i, _ in batch], [d for _, d in batch]
+                    ))
+                    # Bound the batches in flight so memory stays flat on large corpora
+                    while len(pending) >= concurrency * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for embed_future in done:
+                            ids, docs, vectors = embed_future.result()
+                            vectorstore = append_batch(vectorstore, embeddings, ids, docs, vectors)
+                            added += len(ids)
+                            batches += 1
 
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+            for embed_future in as_completed(pending):
+                ids, docs, vectors = embed_future.result()
+                vectorstore = append_batch(vectorstore, embeddings, ids, docs, vectors)
+                added += len(ids)
+                batches += 1
+
+        if vectorstore is None:
+            print("No documents loaded. Exiting.")
+            return None
 
-    print("Creating FAISS index...")
-    try:
-        vectorstore = FAISS.from_documents(documents, embeddings)
         print("Saving FAISS index to local folder...")
-        vectorstore.save_local("faiss_index")
-        print("Ingestion complete! Index saved to 'faiss_index'.")
+        with locked_file(os.path.join(index_path, ".lock")):
+            if index_fingerprint(index_path) != loaded_fingerprint:
+                merge_new_golden(vectorstore, embeddings, index_path)
+            convert_index(vectorstore, index_type)
+            atomic_save(vectorstore, index_path)
+            LexicalIndex.from_faiss(vectorstore, index_fingerprint(index_path)).save(index_path)
+            save_manifest(manifest, index_path)
     except Exception as e:
         print(f"Error creating/saving index: {e}")
+        return None
+
+    elapsed = time.time() - started
+    print(f"Ingestion complete! Index saved to '{index_path}' "
+          f"({len(vectorstore.index_to_docstore_id)} vectors, {index_type_of(vectorstore.index)} index).")
+    print(f"Embedded {added} chunks in {batches} batches in {elapsed:.1f}s.")
+    if hasattr(embeddings, "cache"):
+        stats = get_embedding_cache().stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['entries']} cached vectors).")
+
+    return {
+        "files_processed": len(changed),
+        "files_removed": len(removed),
+        "chunks_added": added,
+        "chunks_removed": removed_chunks,
+        "batches": batches,
+        "vectors": len(vectorstore.index_to_docstore_id),
+        "elapsed": elapsed,
+    }
 
 if __name__ == "__main__":
-    ingest_data()
+    parser = argparse.ArgumentParser(description="Ingest PDFs from data/ into the FAISS index.")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-process every PDF instead of only new or changed files.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="PDF parsing processes.")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks per embedding request.")
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY, help="Embedding requests in flight.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE,
+                        help="FAISS index type to save (see index_types.py).")
+    args = parser.parse_args()
+    ingest_data(full_rebuild=args.full, workers=args.workers, batch_size=args.batch_size,
+                concurrency=args.concurrency, index_type=args.index_type)
@@ -0,0 +1,145 @@
+# lexical_index.py
+"""
+BM25 keyword index over the same chunks as the FAISS index.
+
+Policy questions often hinge on exact terms ("Acceptable Use", "RDM plan", section
+numbers like 4.2.1) that embeddings blur. The index is derived from the FAISS
+docstore and persisted as `faiss_index/bm25.json`, tagged with the fingerprint of the
+FAISS files it was built from; if the FAISS index changes it is rebuilt on load.
+It stores chunk ids only, the text stays in the FAISS docstore.
+"""
+import os
+import re
+import json
+import math
+import heapq
+import logging
+from collections import Counter
+
+from docstore import iter_documents
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_FILE = "bm25.json"
+LEXICAL_INDEX_VERSION = 1
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words, and dotted section numbers ("4.2.1") kept as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in is it its "
+    "may must no not of on or our should that the their there these this to was we what "
+    "when where which who will with you your".split()
+)
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class LexicalIndex:
+    def __init__(self, ids, lengths, postings, fingerprint=None):
+        self.ids = ids
+        self.lengths = lengths
+        self.postings = postings  # term -> [[doc index, term frequency], ...]
+        self.fingerprint = fingerprint
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        count = len(ids)
+        self.idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+
+    @classmethod
+    def build(cls, documents, fingerprint=None):
+        """`documents` is an iterable of (chunk id, text)."""
+        ids, lengths, postings = [], [], {}
+        for doc_id, text in documents:
+            tokens = tokenize(text)
+            index = len(ids)
+            ids.append(doc_id)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append([index, tf])
+        return cls(ids, lengths, postings, fingerprint)
+
+    @classmethod
+    def from_faiss(cls, store, fingerprint=None):
+        return cls.build(((doc_id, doc.page_content) for doc_id, doc in iter_documents(store)), fingerprint)
+
+    def search(self, query, k=10):
+        """[(chunk id, BM25 score)], best first."""
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[index] / (self.avg_length or 1))
+                scores[index] = scores.get(index, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[index], score) for index, score in best]
+
+    # --- Persistence ---
+
+    def save(self, index_path):
+        path = os.path.join(index_path, LEXICAL_INDEX_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": LEXICAL_INDEX_VERSION,
+                "fingerprint": self.fingerprint,
+                "ids": self.ids,
+                "lengths": self.lengths,
+                "postings": self.postings,
+            }, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, index_path, fingerprint):
+        """Returns the persisted index if it was built from the FAISS files with `fingerprint`, else None."""
+        path = os.path.join(index_path, LEXICAL_INDEX_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if data.get("version") != LEXICAL_INDEX_VERSION or _as_tuple(data.get("fingerprint")) != _as_tuple(fingerprint):
+            return None
+        return cls(data["ids"], data["lengths"], data["postings"], fingerprint)
+
+
+def _as_tuple(value):
+    # JSON turns the fingerprint's tuples into lists
+    if isinstance(value, (list, tuple)):
+        return tuple(_as_tuple(v) for v in value)
+    return value
+
+
+def load_or_build(store, index_path, fingerprint):
+    index = LexicalIndex.load(index_path, fingerprint)
+    if index is not None:
+        return index
+    logger.info("Building BM25 index for %s...", index_path)
+    index = LexicalIndex.from_faiss(store, fingerprint)
+    try:
+        index.save(index_path)
+    except OSError as e:
+        logger.warning("Could not persist the BM25 index: %s", e)
+    return index
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several ranked id lists: score(id) = sum of 1 / (k + rank). Scores are scaled
+    so an id ranked first by every list scores 1.0. Returns [(id, score)], best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    best_possible = len(rankings) / (k + 1) if rankings else 1.0
+    return sorted(((doc_id, score / best_possible) for doc_id, score in fused.items()),
+                  key=lambda item: item[1], reverse=True)
@@ -0,0 +1,281 @@
+"""
+End-to-end load test for /chat with stub models (no Gemini calls, no API key needed).
+
+Builds a throwaway copy of the knowledge base embedded with the fake backend, starts the
+app in a scratch directory with LLM_BACKEND=stub and EMBEDDING_BACKEND=fake (see
+stub_models.py), replays the questions from the query log with N concurrent streaming
+clients over HTTP, and reports throughput, time to first event, time to first answer
+text and total latency percentiles.
+
+    python load_test.py --server wsgi --concurrency 20 --requests 200
+    python load_test.py --server asgi --concurrency 200 --requests 2000 --llm-latency 0.8
+    python load_test.py --url http://127.0.0.1:8090 --concurrency 20   # a server you started
+
+Results can be written as JSON (--json) and compared between runs. With --max-p95 the
+script exits with status 1 when p95 total latency is above it, so it can gate changes
+to the agent loop, logging or retrieval in CI.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode, urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+QUERY_LOG_PATHS = ("query_log.jsonl", "query_log.json")
+FALLBACK_QUERIES_PATH = "synthetic_dataset.json"
+READY_TIMEOUT = 120  # Seconds to wait for /readyz
+
+
+# --- Traffic ---
+
+def _read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def load_queries(path=None):
+    """Questions in logged order (repeats kept, so the answer cache sees the real mix)."""
+    paths = [path] if path else [os.path.join(REPO_DIR, p) for p in QUERY_LOG_PATHS]
+    for candidate in paths:
+        if os.path.exists(candidate):
+            queries = [r.get("query") or r.get("question") for r in _read_records(candidate)]
+            queries = [q for q in queries if q and q.strip()]
+            if queries:
+                return queries
+    records = _read_records(os.path.join(REPO_DIR, FALLBACK_QUERIES_PATH))
+    return [r["question"] for r in records]
+
+
+# --- Server under test ---
+
+def build_index(index_path, size):
+    """Copy of the knowledge base chunks, embedded with the (instant) fake backend."""
+    from langchain_community.vectorstores import FAISS
+    from docstore import DOCSTORE_FILE, read_all
+    from index_layout import current_dir
+    from embedding_backends import FakeEmbeddings
+    from vector_store import FAISS_INDEX_PATH, atomic_save
+
+    docs = list(read_all(os.path.join(current_dir(os.path.join(REPO_DIR, FAISS_INDEX_PATH)), DOCSTORE_FILE)).values())
+    store = FAISS.from_documents(docs, FakeEmbeddings(size=size, latency=0), ids=[d.id for d in docs])
+    atomic_save(store, index_path)
+    return len(docs)
+
+
+def start_server(kind, port, workdir, args):
+    env = dict(os.environ)
+    env.update({
+        "LLM_BACKEND": "stub",
+        "EMBEDDING_BACKEND": "fake",
+        "FAKE_EMBEDDING_SIZE": str(args.embedding_size),
+        "FAKE_EMBEDDING_LATENCY": str(args.embed_latency),
+        "STUB_LLM_LATENCY": str(args.llm_latency),
+        "STUB_LLM_CHUNK_LATENCY": str(args.chunk_latency),
+        "STUB_TOOL_CALLS": str(args.tool_calls),
+        "STUB_TOOL_STEPS": str(args.tool_steps),
+        "FAISS_INDEX_PATH": os.path.join(workdir, "faiss_index"),
+        "EVENT_STORE_DIR": workdir,
+        "TRACE_DIR": workdir,
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite"),
+        "ANSWER_CACHE_ENABLED": "false" if args.no_cache else "true",
+        "SPECULATIVE_RETRIEVAL": "true" if args.speculative else "false",
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+        "PORT": str(port),
+        "PYTHONPATH": REPO_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    if kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--app-dir", REPO_DIR,
+                   "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, os.path.join(REPO_DIR, "app.py")]
+    log = open(os.path.join(workdir, "server.log"), "w")
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(url, server=None):
+    deadline = time.time() + READY_TIMEOUT
+    target = urlparse(url)
+    while time.time() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError("Server exited during startup (see server.log).")
+        try:
+            conn = http.client.HTTPConnection(target.hostname, target.port, timeout=2)
+            conn.request("GET", "/readyz")
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} was not ready after {READY_TIMEOUT}s.")
+
+
+# --- Clients ---
+
+def chat_once(url, query, timeout):
+    """Streams one /chat answer; returns timings in seconds and whether an answer arrived."""
+    target = urlparse(url)
+    body = urlencode({"user_input": query})
+    started = time.perf_counter()
+    first_event = first_answer = None
+    ok, events = False, 0
+    conn = http.client.HTTPConnection(target.hostname, target.port, timeout=timeout)
+    try:
+        conn.request("POST", "/chat", body=body, headers={"Content-Type": "application/x-www-form-urlencoded"})
+        response = conn.getresponse()
+        if response.status != 200:
+            return {"ok": False, "error": f"HTTP {response.status}", "total": time.perf_counter() - started}
+        for line in response:
+            if not line.strip():
+                continue
+            now = time.perf_counter() - started
+            event = json.loads(line)
+            events += 1
+            first_event = first_event if first_event is not None else now
+            if event["type"] in ("answer_delta", "answer") and first_answer is None:
+                first_answer = now
+            if event["type"] == "answer":
+                ok = True
+            elif event["type"] == "error":
+                return {"ok": False, "error": event.get("content"), "total": now}
+    except OSError as e:
+        return {"ok": False, "error": str(e), "total": time.perf_counter() - started}
+    finally:
+        conn.close()
+    return {"ok": ok, "error": None if ok else "no answer", "first_event": first_event,
+            "first_answer": first_answer, "total": time.perf_counter() - started, "events": events}
+
+
+def run_load(url, queries, concurrency, requests, timeout):
+    """Closed loop: `concurrency` clients each send their next request as soon as the last one ends."""
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    results = []
+
+    def client():
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            results.append(chat_once(url, queries[n % len(queries)], timeout))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    return results, time.perf_counter() - started
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            "max": round(float(max(values)), 4)}
+
+
+def summarise(results, elapsed):
+    ok = [r for r in results if r["ok"]]
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "throughput": round(len(ok) / elapsed, 2) if elapsed else 0,
+        "first_event": _percentiles([r["first_event"] for r in ok if r.get("first_event") is not None]),
+        "first_answer": _percentiles([r["first_answer"] for r in ok if r.get("first_answer") is not None]),
+        "total": _percentiles([r["total"] for r in ok]),
+    }
+
+
+def print_report(label, summary):
+    print(f"\n=== Load Test: {label} ===")
+    print(f"{summary['ok']}/{summary['requests']} ok in {summary['seconds']}s "
+          f"({summary['throughput']} answers/s)")
+    if summary["errors"]:
+        print("Errors: " + ", ".join(f"{k} x{v}" for k, v in summary["errors"].items()))
+    print(f"{'seconds':<14} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name in ("first_event", "first_answer", "total"):
+        row = summary[name]
+        cells = " ".join(f"{row[p]:>8.3f}" if row[p] is not None else f"{'-':>8}" for p in ("p50", "p95", "p99", "max"))
+        print(f"{name:<14} {cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /chat end to end with stub Gemini models.")
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi",
+                        help="Start app.py (Flask) or asgi.py (uvicorn) with stub models.")
+    parser.add_argument("--url", help="Test an already running server instead of starting one.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent streaming clients.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10, help="Requests sent (and ignored) before measuring.")
+    parser.add_argument("--queries", help="Query log (.json list or .jsonl) to replay; default query_log.")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request socket timeout.")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Stub seconds to first LLM chunk.")
+    parser.add_argument("--chunk-latency", type=float, default=0.02, help="Stub seconds between streamed chunks.")
+    parser.add_argument("--tool-calls", type=int, default=1, help="Stub lookup_guides calls per tool step.")
+    parser.add_argument("--tool-steps", type=int, default=1, help="Stub tool steps before answering.")
+    parser.add_argument("--embed-latency", type=float, default=0.1, help="Fake seconds per embedding request.")
+    parser.add_argument("--embedding-size", type=int, default=768)
+    parser.add_argument("--no-cache", action="store_true", help="Disable the answer cache on the server.")
+    parser.add_argument("--speculative", action="store_true", help="Enable speculative retrieval on the server.")
+    parser.add_argument("--json", help="Write the summary to this file.")
+    parser.add_argument("--max-p95", type=float, help="Exit with status 1 if p95 total latency exceeds this.")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    server, workdir = None, None
+    url = args.url
+    try:
+        if not url:
+            workdir = tempfile.mkdtemp(prefix="load_test_")
+            chunks = build_index(os.path.join(workdir, "faiss_index"), args.embedding_size)
+            print(f"Built a {chunks}-chunk stub index; starting the {args.server} server in {workdir}...")
+            server = start_server(args.server, args.port, workdir, args)
+            url = f"http://127.0.0.1:{args.port}"
+        wait_until_ready(url, server)
+
+        if args.warmup:
+            run_load(url, queries, min(args.concurrency, args.warmup), args.warmup, args.timeout)
+        results, elapsed = run_load(url, queries, args.concurrency, args.requests, args.timeout)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if workdir and not args.url:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarise(results, elapsed)
+    summary["settings"] = {k: v for k, v in vars(args).items() if k not in ("json", "max_p95")}
+    label = args.url or f"{args.server}, {args.concurrency} clients, {len(set(queries))} distinct queries"
+    print_report(label, summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    p95 = summary["total"]["p95"]
+    if args.max_p95 is not None and (p95 is None or p95 > args.max_p95 or summary["ok"] < summary["requests"]):
+        print(f"FAIL: p95 total latency {p95}s exceeds {args.max_p95}s or requests failed.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# logging_setup.py
+"""
+Process-wide logging configuration.
+
+- Request threads only enqueue records; a QueueListener thread formats and writes them,
+  so slow stdout or a busy log shipper never stalls a chat request.
+- Records are formatted on the listener thread, so `logger.debug("... %s", obj)` costs
+  nothing beyond a level check when DEBUG is off.
+- Levels are set globally (LOG_LEVEL) and per module (LOG_LEVELS="service_desk_bot=DEBUG,vector_store=WARNING").
+- Verbose payloads (full LLM responses, tool results) go to `<module>.payload` loggers,
+  which are sampled (LOG_PAYLOAD_SAMPLE_RATE) and truncated (LOG_PAYLOAD_MAX_CHARS).
+"""
+import os
+import sys
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# --- CONFIGURATION ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")  # Per-module overrides: "name=LEVEL,name=LEVEL"
+LOG_FILE = os.getenv("LOG_FILE")  # Optional; stderr otherwise
+LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s")
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))  # Fraction of payload records kept
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "500"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # Records beyond this are dropped, not waited for
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Enqueues records unformatted (the listener formats them) and drops them when the queue is full."""
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # Tracebacks reference live frames; render them before handing off
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class Truncated:
+    """Log argument rendered (and cut to `limit` characters) only if the record is actually written."""
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit or LOG_PAYLOAD_MAX_CHARS
+
+    def __str__(self):
+        text = str(self.value)
+        return text if len(text) <= self.limit else text[:self.limit] + "..."
+
+
+def get_payload_logger(name):
+    """Logger for verbose payloads of module `name`, sampled at LOG_PAYLOAD_SAMPLE_RATE."""
+    payload_logger = logging.getLogger(f"{name}.payload")
+    if not any(isinstance(f, SamplingFilter) for f in payload_logger.filters):
+        payload_logger.addFilter(SamplingFilter(LOG_PAYLOAD_SAMPLE_RATE))
+    return payload_logger
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Installs the queue-based pipeline on the root logger. Safe to call more than once."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        if LOG_FILE:
+            output = logging.FileHandler(LOG_FILE, encoding="utf-8")
+        else:
+            output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_DeferredQueueHandler(log_queue))
+        root.setLevel(LOG_LEVEL)
+        for name, level in _parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
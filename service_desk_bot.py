@@ -3,98 +3,207 @@
 Service Desk Chatbot core logic using Google Gemini with manual ReAct loop.
 """
 import os
+import time
+import textwrap
+import asyncio
+import weakref
 import logging
 import json
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # --- LANGCHAIN IMPORTS ---
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+# (langchain_google_genai, FAISS and the embedding clients are imported in init_clients: they dominate startup time)
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.tools import tool
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from answer_cache import SemanticAnswerCache, ANSWER_CACHE_ENABLED, normalize_query
+from single_flight import SingleFlight, async_flights
+from embedding_backends import EMBEDDING_BACKEND
+import tracing
+from context_assembly import assemble_context, format_context, estimate_tokens, CONTEXT_CANDIDATES
+from lexical_index import tokenize
+from logging_setup import configure_logging, get_payload_logger, Truncated
+
+# Configure logging (queue-based, non-blocking; see logging_setup.py)
+configure_logging()
 logger = logging.getLogger(__name__)
+payload_log = get_payload_logger(__name__)  # Sampled, truncated LLM/tool payloads at DEBUG
 
 # Load env vars
 load_dotenv()
 
 # --- CONFIGURATION ---
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-FAISS_INDEX_PATH = "faiss_index"
+LLM_BACKEND = os.getenv("LLM_BACKEND", "google")  # google | stub (stub_models.py, for load tests)
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index")
+# Stream the final answer token-by-token (can be overridden per request via dev_settings['stream'])
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() == "true"
+# Async serving mode (asgi.py): upstream LLM calls in flight per process, and how long a call may queue for a slot
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Tool results kept verbatim in the agent's message list; older ones are replaced by a short note
+TOOL_RESULT_TOKEN_BUDGET = int(os.getenv("AGENT_TOOL_RESULT_TOKEN_BUDGET", "4000"))
+# Seconds before a failed client initialisation is attempted again by the next request
+CLIENT_INIT_RETRY_INTERVAL = float(os.getenv("CLIENT_INIT_RETRY_INTERVAL", "30"))
+# Threads shared by all requests for running tool calls (and, in async mode, other blocking work)
+TOOL_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", "16"))
+# Identical standalone questions asked while one is being answered share that answer's run
+COALESCE_QUESTIONS = os.getenv("COALESCE_QUESTIONS", "true").lower() == "true"
+# Search the knowledge base for the raw question while the first LLM step is still planning
+# (can be overridden per request via dev_settings['speculative'])
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+# Term overlap (Jaccard, stopwords removed) a tool query needs with the question to reuse that search
+SPECULATIVE_MATCH_THRESHOLD = float(os.getenv("SPECULATIVE_MATCH_THRESHOLD", "0.5"))
 
 # Global Clients
-vectorstore = None
+vectorstore = None  # Shared VectorStoreService (same instance the admin blueprint writes to)
 llm = None
+embeddings = None
+answer_cache = SemanticAnswerCache(FAISS_INDEX_PATH) if ANSWER_CACHE_ENABLED else None
+
+# Client lifecycle: nothing is loaded at import. The first request (or warm_up() at server
+# start) initialises the clients once; concurrent callers wait for that single attempt.
+_init_lock = threading.Lock()
+_init_state = {"status": "not_started", "error": None, "attempted_at": None, "seconds": None}
 
 def init_clients():
-    global vectorstore, llm
-    
-    print("DEBUG: Initializing Gemini clients...")
+    """Loads the embeddings, the FAISS index and the LLM. Runs under _init_lock; use ensure_clients()."""
+    global vectorstore, llm, embeddings
     
-    if not GOOGLE_API_KEY:
-        logger.error("GOOGLE_API_KEY not found.")
-        print("DEBUG: GOOGLE_API_KEY not found.")
-        return
+    logger.info("Initializing Gemini clients...")
+    started = time.perf_counter()
+    _init_state.update(status="initializing", error=None, attempted_at=time.time())
 
     try:
-        # Initialize Embeddings (needed to load FAISS)
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+        if not GOOGLE_API_KEY and "google" in (EMBEDDING_BACKEND, LLM_BACKEND):
+            logger.error("GOOGLE_API_KEY not found.")
+            if EMBEDDING_BACKEND == "google":
+                _init_state["error"] = "GOOGLE_API_KEY not found."
+                return
+
+        from embedding_cache import get_embeddings
+        from vector_store import get_vector_store
+
+        # Initialize Embeddings (needed to load FAISS), backed by the shared on-disk cache
+        embeddings = get_embeddings()
         
         # Load FAISS Index
-        if os.path.exists(FAISS_INDEX_PATH):
-            vectorstore = FAISS.load_local(FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-            print("DEBUG: FAISS index loaded successfully.")
+        vectorstore = get_vector_store(embeddings)
+        if vectorstore.is_loaded:
+            logger.info("FAISS index loaded successfully.")
         else:
-            print("DEBUG: FAISS index not found. Please run ingest_data.py.")
+            logger.warning("FAISS index not found. Please run ingest_data.py.")
+
+        if LLM_BACKEND == "stub":
+            from stub_models import StubChatModel
+            llm = StubChatModel()
+            logger.warning("Using the stub LLM (LLM_BACKEND=stub); answers are placeholders.")
+            return
+
+        if not GOOGLE_API_KEY:
+            _init_state["error"] = "GOOGLE_API_KEY not found."
+            return  # Local retrieval works; the agent needs Gemini
 
         # Initialize LLM
+        from langchain_google_genai import ChatGoogleGenerativeAI
         llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
-        print("DEBUG: Gemini LLM initialized.")
+        logger.info("Gemini LLM initialized.")
         
     except Exception as e:
-        logger.error(f"Init failed: {e}")
-        print(f"DEBUG: Client init failed: {e}")
+        logger.error("Client init failed: %s", e)
+        _init_state["error"] = str(e)
+    finally:
+        _init_state["seconds"] = round(time.perf_counter() - started, 3)
+        _init_state["status"] = "ready" if llm is not None and _init_state["error"] is None else "failed"
+
+def ensure_clients():
+    """Initialises the clients on first use. Thread-safe; a failed attempt is retried after CLIENT_INIT_RETRY_INTERVAL."""
+    if _init_state["status"] == "ready" or (
+            _init_state["status"] == "failed"
+            and time.time() - _init_state["attempted_at"] < CLIENT_INIT_RETRY_INTERVAL):
+        return
+    with _init_lock:
+        if _init_state["status"] == "ready":
+            return
+        if _init_state["status"] == "failed" and time.time() - _init_state["attempted_at"] < CLIENT_INIT_RETRY_INTERVAL:
+            return
+        init_clients()
+
+def warm_up():
+    """Starts client initialisation in the background so the first request does not pay for it."""
+    thread = threading.Thread(target=ensure_clients, name="client-warmup", daemon=True)
+    thread.start()
+    return thread
 
-init_clients()
+def client_status():
+    """What is loaded, for the readiness endpoint."""
+    index_loaded = bool(vectorstore and vectorstore.is_loaded)
+    return {
+        **_init_state,
+        "ready": _init_state["status"] == "ready" and index_loaded,
+        "llm": llm is not None,
+        "embeddings": embeddings is not None,
+        "index_loaded": index_loaded,
+        "answer_cache": answer_cache is not None,
+    }
 
 # --- 1. DEFINE THE TOOL ---
 
-@tool
-def lookup_guides(query: str) -> str:
+def search_guides(query: str):
     """
-    Useful for finding information about Macquarie University policies, procedures, guidelines, and rules.
-    Input should be a specific search query (e.g., 'Computer security procedure' or 'it misuse').
-    Returns a text summary of the relevant document passages.
+    Runs the knowledge base search behind `lookup_guides`.
+    Returns (text for the agent, assembled passages as Documents) so callers can inspect what was retrieved.
     """
-    print(f"DEBUG: Agent is searching for: {query}")
+    logger.debug("Agent is searching for: %s", query)
+    ensure_clients()
     
-    if not vectorstore:
-        return "Error: Knowledge base not loaded. Please contact admin."
+    if not vectorstore or not vectorstore.is_loaded:
+        return "Error: Knowledge base not loaded. Please contact admin.", []
 
     try:
-        # Run Search
-        results = vectorstore.similarity_search(query, k=5)
+        # Run Search (a few extra candidates; the assembler dedupes, merges and trims them)
+        results = vectorstore.search(query, k=CONTEXT_CANDIDATES)
 
-        # Format results for the Agent to read
-        results_text = []
-        for r in results:
-            content = r.page_content
-            source = r.metadata.get('source', 'Unknown')
-            snippet = f"Source: {source}\nContent: {content}"
-            results_text.append(snippet)
+        with tracing.span("retrieval.assemble", candidates=len(results)) as assemble_span:
+            passages = assemble_context(results)
+            assemble_span.set(passages=len(passages))
         
-        if not results_text:
-            return "No relevant documents found in the database."
+        if not passages:
+            return "No relevant documents found in the database.", []
             
-        return "\n\n".join(results_text)
+        # Format results for the Agent to read
+        return format_context(passages), passages
     except Exception as e:
-        print(f"DEBUG: Search tool error: {e}")
-        return f"Error during search: {str(e)}"
+        logger.error("Search tool error: %s", e)
+        return f"Error during search: {str(e)}", []
+
+@tool
+def lookup_guides(query: str) -> str:
+    """
+    Useful for finding information about Macquarie University policies, procedures, guidelines, and rules.
+    Input should be a specific search query (e.g., 'Computer security procedure' or 'it misuse').
+    Returns a text summary of the relevant document passages.
+    """
+    return search_guides(query)[0]
 
 # --- 2. MANUAL AGENT LOOP ---
 
+def extract_text(content):
+    """Flattens message content (plain string or list of parts, common in newer Gemini versions) to text."""
+    if isinstance(content, list):
+        text_parts = []
+        for part in content:
+            if isinstance(part, dict) and 'text' in part:
+                text_parts.append(part['text'])
+            elif isinstance(part, str):
+                text_parts.append(part)
+        return "".join(text_parts)
+    return content or ""
+
 def format_chat_history(history_list):
     """Converts list of dicts [{'role': 'user', 'content': '...'}, ...] to string."""
     formatted = []
@@ -104,29 +213,53 @@ def format_chat_history(history_list):
         formatted.append(f"{role}: {content}")
     return "\n".join(formatted)
 
-def ask_service_desk_stream(user_query: str, chat_history: list = None, dev_settings: dict = None):
-    """
-    Generator that yields events:
-    {'type': 'log', 'content': '...'} -> Thinking/Action updates
-    {'type': 'answer', 'content': '...'} -> Final answer
-    """
-    if dev_settings is None: dev_settings = {}
-    if chat_history is None: chat_history = []
-    
-    formatted_history = format_chat_history(chat_history)
-    collected_sources = []
-    
-    if not llm:
-        yield {"type": "error", "content": "LLM not initialized."}
-        return
+class AgentMetrics:
+    """Collects what one agent run actually did: retrieved contexts, tool calls, steps, latency and tokens."""
 
-    try:
-        # Bind tools to LLM
-        tools = [lookup_guides]
-        llm_with_tools = llm.bind_tools(tools)
-        
-        # System Prompt
-        system_message = """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = 0
+        self.llm_seconds = []
+        self.tool_calls = []
+        self.retrieval_seconds = 0.0  # Wall time of tool steps (calls within a step overlap)
+        self.speculation = None  # 'hit' or 'miss' when the question was searched speculatively
+        self.contexts = []
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def record_llm(self, seconds, response):
+        self.steps += 1
+        self.llm_seconds.append(round(seconds, 3))
+        usage = getattr(response, 'usage_metadata', None) or {}
+        self.input_tokens += usage.get('input_tokens', 0)
+        self.output_tokens += usage.get('output_tokens', 0)
+
+    def record_retrieval(self, seconds):
+        self.retrieval_seconds += seconds
+
+    def record_tool(self, query, seconds, docs):
+        self.tool_calls.append({"query": query, "seconds": round(seconds, 3), "results": len(docs)})
+        for d in docs:
+            if d.page_content not in self.contexts:
+                self.contexts.append(d.page_content)
+
+    def event(self):
+        return {
+            "type": "metrics",
+            "contexts": self.contexts,
+            "steps": self.steps,
+            "tool_calls": self.tool_calls,
+            "latency": {
+                "total": round(time.perf_counter() - self.started, 3),
+                "llm": round(sum(self.llm_seconds), 3),
+                "retrieval": round(self.retrieval_seconds, 3),
+                "llm_steps": self.llm_seconds,
+            },
+            "tokens": {"input": self.input_tokens, "output": self.output_tokens},
+            "speculation": self.speculation,
+        }
+
+SYSTEM_PROMPT = """
         ### IDENTITY & SCOPE
         You are the **Macquarie University Policy Central Assistant**.
         Your ONLY purpose is to assist staff and students with questions about University policies, procedures, guidelines, and rules based on the provided knowledge base.
@@ -149,106 +282,593 @@ def ask_service_desk_stream(user_query: str, chat_history: list = None, dev_sett
         - **Escalation:** If you cannot answer, say: "I cannot answer this based on the available policy documents. Please contact the Policy team at policy@mq.edu.au."
         """
 
-        messages = [
-            HumanMessage(content=f"{system_message}\n\nPrevious Conversation:\n{formatted_history}\n\nQuestion: {user_query}")
-        ]
+# Built once: identical on every call, so the provider can cache the prompt prefix
+SYSTEM_MESSAGE = SystemMessage(content=textwrap.dedent(SYSTEM_PROMPT).strip())
+TOOLS = [lookup_guides]
+
+MAX_STEPS = 5
+GIVE_UP_ANSWER = "I apologize, but I am unable to find a specific answer after multiple attempts. Please contact the Service Desk for further assistance."
+PLANNING_EVENT = {"type": "log", "content": "Planning: Analyzing user request and checking context..."}
+FINALIZING_EVENT = {"type": "log", "content": "Finalizing: Formulating response based on retrieved policies."}
+
+
+class LLMBusyError(Exception):
+    """Raised when an upstream LLM slot does not free up within LLM_QUEUE_TIMEOUT."""
+
+
+_llm_semaphores = weakref.WeakKeyDictionary()  # One semaphore per event loop
+
+@asynccontextmanager
+async def llm_slot():
+    """
+    Holds one of LLM_MAX_CONCURRENCY upstream call slots (async serving mode).
+    Callers queue for a free slot for up to LLM_QUEUE_TIMEOUT seconds.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _llm_semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    try:
+        with tracing.span("agent.llm_queue"):
+            await asyncio.wait_for(semaphore.acquire(), timeout=LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise LLMBusyError("The assistant is busy right now. Please try again in a moment.")
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def _use_answer_cache(chat_history, dev_settings):
+    return (answer_cache is not None and embeddings is not None
+            and not chat_history and dev_settings.get('use_cache', True)
+            and not dev_settings.get('collect_metrics'))
+
+def _cache_hit_events(user_query, cached):
+    logger.debug("Answer cache hit for: %s", user_query)
+    return [
+        {"type": "log", "content": "Planning: This question was answered recently, reusing the verified response..."},
+        {"type": "answer", **cached["answer"], "cached": True},
+    ]
+
+JOINED_EVENT = {"type": "log", "content": "Planning: This question is already being answered for someone else, joining that answer..."}
+
+_flights = SingleFlight()
+
+def _coalesce_key(user_query, chat_history, dev_settings):
+    """
+    Requests with the same key can share one run; None when the request must run on its own.
+    Like the answer cache, only standalone questions qualify (follow-ups depend on history).
+    """
+    if (not COALESCE_QUESTIONS or chat_history or dev_settings.get('collect_metrics')
+            or not dev_settings.get('coalesce', True)):
+        return None
+    return (normalize_query(user_query), dev_settings.get('stream', STREAM_ANSWERS), dev_settings.get('use_cache', True))
+
+def ask_service_desk_stream(user_query: str, chat_history: list = None, dev_settings: dict = None):
+    """
+    Answers from the semantic answer cache when possible, otherwise runs the agent.
+    Cache hits are replayed as the same events the agent would produce.
+    Only standalone questions (no previous conversation) are cached, since
+    follow-ups depend on context the cache key does not capture. An identical
+    standalone question that is already being answered is not run again: the
+    request receives the events of the run in flight (see single_flight.py).
+    """
+    if dev_settings is None: dev_settings = {}
+    ensure_clients()
+
+    key = _coalesce_key(user_query, chat_history, dev_settings)
+    if key is None:
+        yield from _answer_stream(user_query, chat_history, dev_settings)
+        return
+    yield from _flights.stream(key, lambda: _answer_stream(user_query, chat_history, dev_settings),
+                               joined_events=[JOINED_EVENT])
+
+def _answer_stream(user_query, chat_history, dev_settings):
+    if not _use_answer_cache(chat_history, dev_settings):
+        yield from _run_agent_stream(user_query, chat_history, dev_settings)
+        return
+
+    try:
+        with tracing.span("cache.lookup") as cache_span:
+            cached, query_vector = answer_cache.get(user_query, embeddings.embed_query)
+            cache_span.set(hit=bool(cached))
+    except Exception as e:
+        logger.warning("Answer cache lookup failed: %s", e)
+        yield from _run_agent_stream(user_query, chat_history, dev_settings)
+        return
+
+    if cached:
+        yield from _cache_hit_events(user_query, cached)
+        return
+
+    for event in _run_agent_stream(user_query, chat_history, dev_settings):
+        if event['type'] == 'answer' and not event.get('needs_email_support'):
+            answer_cache.put(user_query, query_vector, event)
+        yield event
+
+async def ask_service_desk_astream(user_query: str, chat_history: list = None, dev_settings: dict = None):
+    """
+    Async variant of ask_service_desk_stream for the ASGI server (asgi.py); yields the same events.
+    LLM calls use the model's async APIs and wait for a slot from llm_slot(); blocking work
+    (embedding, FAISS search) runs on the tool pool (AGENT_TOOL_WORKERS threads) so the
+    event loop keeps serving other streams.
+    """
+    if dev_settings is None: dev_settings = {}
+    await _in_tool_pool(ensure_clients)
+
+    key = _coalesce_key(user_query, chat_history, dev_settings)
+    if key is None:
+        events = _aanswer_stream(user_query, chat_history, dev_settings)
+    else:
+        events = async_flights().stream(key, lambda: _aanswer_stream(user_query, chat_history, dev_settings),
+                                        joined_events=[JOINED_EVENT])
+    async for event in events:
+        yield event
+
+async def _aanswer_stream(user_query, chat_history, dev_settings):
+    if not _use_answer_cache(chat_history, dev_settings):
+        async for event in _arun_agent_stream(user_query, chat_history, dev_settings):
+            yield event
+        return
+
+    try:
+        with tracing.span("cache.lookup") as cache_span:
+            cached, query_vector = await _in_tool_pool(answer_cache.get, user_query, embeddings.embed_query)
+            cache_span.set(hit=bool(cached))
+    except Exception as e:
+        logger.warning("Answer cache lookup failed: %s", e)
+        cached, query_vector = None, None
+
+    if cached:
+        for event in _cache_hit_events(user_query, cached):
+            yield event
+        return
+
+    async for event in _arun_agent_stream(user_query, chat_history, dev_settings):
+        if query_vector is not None and event['type'] == 'answer' and not event.get('needs_email_support'):
+            answer_cache.put(user_query, query_vector, event)
+        yield event
+
+# --- Agent loop building blocks (shared by the sync and async loops) ---
+
+_bound_llm = (None, None)
+
+def get_llm_with_tools():
+    """The LLM with TOOLS bound, prepared once per client instead of on every request."""
+    global _bound_llm
+    client, bound = _bound_llm
+    if client is not llm:
+        bound = llm.bind_tools(TOOLS)
+        _bound_llm = (llm, bound)
+    return bound
+
+def _initial_messages(user_query, chat_history):
+    with tracing.span("agent.format_history", messages=len(chat_history)):
+        formatted_history = format_chat_history(chat_history)
+    question = f"Question: {user_query}"
+    if formatted_history:
+        question = f"Previous Conversation:\n{formatted_history}\n\n{question}"
+    return [SYSTEM_MESSAGE, HumanMessage(content=question)]
+
+def compact_tool_results(messages, budget=None):
+    """
+    Keeps the newest tool results verbatim up to `budget` estimated tokens and replaces
+    older ones (in place) with a one-line note of what was searched and which sources
+    came back. Every result of the latest tool step is always kept whole: the model has
+    not read them yet.
+    """
+    budget = TOOL_RESULT_TOKEN_BUDGET if budget is None else budget
+    queries = {}
+    current_step = 0  # Index of the newest AIMessage with tool calls
+    for i, message in enumerate(messages):
+        for tool_call in getattr(message, 'tool_calls', None) or []:
+            queries[tool_call['id']] = tool_call['args'].get('query')
+            current_step = i
+
+    used, compacted = 0, 0
+    for message in messages[current_step:]:
+        if isinstance(message, ToolMessage):
+            used += estimate_tokens(str(message.content))
+    for i in range(current_step - 1, -1, -1):
+        message = messages[i]
+        if not isinstance(message, ToolMessage) or message.additional_kwargs.get('compacted'):
+            continue
+        tokens = estimate_tokens(str(message.content))
+        if used + tokens <= budget:
+            used += tokens
+            continue
+        sources = []
+        for line in str(message.content).split('\n'):
+            if line.startswith("Source: ") and line[8:].strip() not in sources:
+                sources.append(line[8:].strip())
+        note = f"[Earlier search for '{queries.get(message.tool_call_id, 'unknown')}' omitted to save space."
+        note += f" Sources returned: {', '.join(sources)}.]" if sources else "]"
+        messages[i] = ToolMessage(content=note, tool_call_id=message.tool_call_id,
+                                  additional_kwargs={'compacted': True})
+        compacted += 1
+    return compacted
+
+class _StreamedStep:
+    """
+    Merges the streamed chunks of one LLM step so tool calls are still detected once the
+    stream ends, and turns text chunks into answer_delta events as soon as they arrive.
+    """
+
+    def __init__(self):
+        self.response = None
+        self.streamed_text = False
+
+    def feed(self, chunk):
+        events = []
+        self.response = chunk if self.response is None else self.response + chunk
+        if self.response.tool_call_chunks:
+            if self.streamed_text:
+                events.append({"type": "answer_reset"})
+                self.streamed_text = False
+            return events
+        delta = extract_text(chunk.content)
+        if delta:
+            if not self.streamed_text:
+                events.append(FINALIZING_EVENT)
+            self.streamed_text = True
+            events.append({"type": "answer_delta", "content": delta})
+        return events
+
+    def result(self):
+        return self.response if self.response is not None else AIMessage(content="")
+
+_STEP_END = object()
+
+async def _astream_step(llm_with_tools, messages, step_stream, events):
+    """
+    Streams one LLM step into the `events` queue while holding an upstream slot, so the
+    slot is released as soon as the model finishes however slowly the client reads.
+    Returns (response, seconds spent in the call); `_STEP_END` is queued last.
+    """
+    try:
+        async with llm_slot():
+            llm_started = time.perf_counter()
+            async for chunk in llm_with_tools.astream(messages):
+                for event in step_stream.feed(chunk):
+                    events.put_nowait(event)
+            return step_stream.result(), time.perf_counter() - llm_started
+    finally:
+        events.put_nowait(_STEP_END)
+
+def _compact_history(messages):
+    with tracing.span("agent.compact_history") as compact_span:
+        compacted = compact_tool_results(messages)
+        compact_span.set(compacted=compacted)
+    if compacted:
+        logger.debug("Compacted %d earlier tool results", compacted)
+
+def _annotate_llm_span(llm_span, response):
+    usage = getattr(response, 'usage_metadata', None) or {}
+    llm_span.set(input_tokens=usage.get('input_tokens'), output_tokens=usage.get('output_tokens'),
+                 tool_calls=len(response.tool_calls))
+
+def _tool_call_events(tool_call):
+    tool_args = tool_call['args']
+    # Agentic Thought Log
+    log_msg = f"Action: Decided to use tool '{tool_call['name']}' to find information about '{tool_args.get('query', 'unknown')}'."
+    logger.debug("Agent action: %s", log_msg)
+    events = [{"type": "log", "content": log_msg}]
+    if tool_call['name'] == "lookup_guides":
+        events.append({"type": "log", "content": f"Execution: Searching knowledge base for '{tool_args.get('query')}'..."})
+    return events
+
+def _execute_tool(tool_call):
+    """Runs one tool call; returns (result text, retrieved passages, seconds)."""
+    if tool_call['name'] != "lookup_guides":
+        return f"Error: Tool {tool_call['name']} not found.", [], 0.0
+    query = tool_call['args'].get('query')
+    tool_started = time.perf_counter()
+    with tracing.span("tool.lookup_guides", query=query, speculative=tool_call.get('id') == "speculative") as tool_span:
+        tool_result, docs = search_guides(query)
+        tool_span.set(results=len(docs))
+    return tool_result, docs, time.perf_counter() - tool_started
+
+_tool_pool = None
+_tool_pool_lock = threading.Lock()
+
+def _get_tool_pool():
+    global _tool_pool
+    with _tool_pool_lock:
+        if _tool_pool is None:
+            _tool_pool = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="agent-tool")
+        return _tool_pool
+
+def _submit_tool(tool_call):
+    # Runs in a copy of the request's context so its span joins the request trace
+    return _get_tool_pool().submit(contextvars.copy_context().run, _execute_tool, tool_call)
+
+def _in_tool_pool(func, *args):
+    """Async mode: awaitable running func(*args) on the tool pool, in a copy of the request's context."""
+    return asyncio.get_running_loop().run_in_executor(_get_tool_pool(), contextvars.copy_context().run, func, *args)
+
+def _dispatch_tools(tool_calls, speculation=None):
+    """
+    Starts every tool call of a step at once; yields their results in call order.
+    The call matched by `speculation` (see _speculate) gets that search's result instead.
+    """
+    reused = speculation.match(tool_calls) if speculation else None
+    if len(tool_calls) == 1:
+        yield speculation.future.result() if reused == 0 else _execute_tool(tool_calls[0])
+        return
+    futures = [speculation.future if i == reused else _submit_tool(tool_call)
+               for i, tool_call in enumerate(tool_calls)]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()  # Searches not yet started when the stream is abandoned
+
+class _Speculation:
+    """A lookup_guides search for the raw question, started alongside the first LLM step."""
+
+    def __init__(self, query, future):
+        self.query = query
+        self.terms = set(tokenize(query))
+        self.future = future  # concurrent.futures.Future, or an asyncio task in the async loop
+
+    def match(self, tool_calls):
+        """Index of the first lookup_guides call whose query is close enough to reuse the search, else None."""
+        for i, tool_call in enumerate(tool_calls):
+            if tool_call['name'] != "lookup_guides":
+                continue
+            terms = set(tokenize(tool_call['args'].get('query') or ""))
+            if terms and self.terms and len(terms & self.terms) / len(terms | self.terms) >= SPECULATIVE_MATCH_THRESHOLD:
+                return i
+        return None
+
+def _speculative_call(user_query, chat_history, dev_settings):
+    """The lookup_guides call to start before the first LLM step, or None."""
+    # Follow-ups are skipped: the model rewrites them with context the raw text lacks
+    if not dev_settings.get('speculative', SPECULATIVE_RETRIEVAL) or chat_history or not vectorstore:
+        return None
+    return {"name": "lookup_guides", "args": {"query": user_query}, "id": "speculative"}
+
+def _speculate(user_query, chat_history, dev_settings):
+    tool_call = _speculative_call(user_query, chat_history, dev_settings)
+    return _Speculation(user_query, _submit_tool(tool_call)) if tool_call else None
+
+def _record_speculation(llm_span, metrics, speculation, tool_calls):
+    hit = speculation.match(tool_calls) is not None
+    logger.debug("Speculative search for '%s': %s", speculation.query, "reused" if hit else "not used")
+    llm_span.set(speculation="hit" if hit else "miss")
+    if metrics:
+        metrics.speculation = "hit" if hit else "miss"
+
+def _record_tool(metrics, tool_call, docs, seconds):
+    if metrics:
+        metrics.record_tool(tool_call['args'].get('query'), seconds, docs)
+
+def _observe(tool_call, tool_result, collected_sources):
+    """Records sources from a tool result; returns (observation events, ToolMessage for the model)."""
+    payload_log.debug("Tool result: %s", Truncated(tool_result))
+    
+    # Extract sources from tool result
+    try:
+        lines = str(tool_result).split('\n')
+        for line in lines:
+            if line.startswith("Source: "):
+                source_name = line.replace("Source: ", "").strip()
+                if source_name and source_name not in collected_sources:
+                    collected_sources.append(source_name)
+    except Exception as e:
+        logger.warning("Error extracting sources: %s", e)
+
+    # Observation Log
+    if "No relevant documents" in str(tool_result):
+        event = {"type": "log", "content": "Observation: No relevant documents found. I may need to refine my search."}
+    else:
+        event = {"type": "log", "content": f"Observation: Found relevant policy information. Synthesizing answer..."}
+    return [event], ToolMessage(content=tool_result, tool_call_id=tool_call['id'])
+
+def _final_events(response, streamed_text, collected_sources, metrics):
+    final_answer = extract_text(response.content)
+    payload_log.debug("Agent answer: %s", Truncated(final_answer, 200))
+
+    # Final thought before answer (already sent when the answer was streamed)
+    events = [] if streamed_text else [FINALIZING_EVENT]
+    needs_support = "I cannot answer" in final_answer
+    events.append({
+        "type": "answer",
+        "content": final_answer,
+        "needs_email_support": needs_support,
+        "sources": collected_sources
+    })
+    if metrics:
+        events.append(metrics.event())
+    return events
+
+def _give_up_events(metrics):
+    logger.info("Max steps reached, giving up.")
+    events = [{"type": "answer", "content": GIVE_UP_ANSWER, "needs_email_support": True}]
+    if metrics:
+        events.append(metrics.event())
+    return events
+
+def _run_agent_stream(user_query: str, chat_history: list = None, dev_settings: dict = None):
+    """
+    Generator that yields events:
+    {'type': 'log', 'content': '...'} -> Thinking/Action updates
+    {'type': 'answer_delta', 'content': '...'} -> Incremental chunk of the final answer (streaming mode)
+    {'type': 'answer_reset'} -> Discard streamed deltas (model switched to a tool call mid-stream)
+    {'type': 'answer', 'content': '...'} -> Final answer
+    {'type': 'metrics', ...} -> Run details for evaluation, sent last (only with dev_settings['collect_metrics'])
+    """
+    if dev_settings is None: dev_settings = {}
+    if chat_history is None: chat_history = []
+    
+    collected_sources = []
+    stream_answer = dev_settings.get('stream', STREAM_ANSWERS)
+    metrics = AgentMetrics() if dev_settings.get('collect_metrics') else None
+    
+    if not llm:
+        yield {"type": "error", "content": "LLM not initialized."}
+        return
+
+    speculation = None
+    try:
+        llm_with_tools = get_llm_with_tools()
+        messages = _initial_messages(user_query, chat_history)
+        speculation = _speculate(user_query, chat_history, dev_settings)
 
         # Manual Loop (max 5 steps)
-        for step in range(5):
-            print(f"\n--- Step {step + 1} ---")
-            
+        for step in range(MAX_STEPS):
             # Yield planning thought
             if step == 0:
-                yield {"type": "log", "content": "Planning: Analyzing user request and checking context..."}
+                yield PLANNING_EVENT
+            else:
+                _compact_history(messages)
             
             # Invoke LLM
-            print(f"DEBUG: Invoking LLM with {len(messages)} messages...")
-            response = llm_with_tools.invoke(messages)
-            print(f"DEBUG: LLM Response: {response}")
+            logger.debug("Step %d: invoking LLM with %d messages", step + 1, len(messages))
+            llm_started = time.perf_counter()
+            step_stream = _StreamedStep()
+            with tracing.span("agent.llm", step=step + 1, streamed=stream_answer) as llm_span:
+                if stream_answer:
+                    # Stream chunks so text can be forwarded as soon as it arrives
+                    for chunk in llm_with_tools.stream(messages):
+                        yield from step_stream.feed(chunk)
+                    response = step_stream.result()
+                else:
+                    response = llm_with_tools.invoke(messages)
+                _annotate_llm_span(llm_span, response)
+                if speculation and step == 0:
+                    _record_speculation(llm_span, metrics, speculation, response.tool_calls)
+            if metrics:
+                metrics.record_llm(time.perf_counter() - llm_started, response)
+            payload_log.debug("LLM response: %s", Truncated(response))
             messages.append(response)
 
-            # Check for tool calls
-            if response.tool_calls:
-                for tool_call in response.tool_calls:
-                    tool_name = tool_call['name']
-                    tool_args = tool_call['args']
-                    tool_id = tool_call['id']
-                    
-                    # Agentic Thought Log
-                    log_msg = f"Action: Decided to use tool '{tool_name}' to find information about '{tool_args.get('query', 'unknown')}'."
-                    print(f"AGENT ACTION: {log_msg}")
-                    yield {"type": "log", "content": log_msg}
-                    
-                    # Execute tool
-                    if tool_name == "lookup_guides":
-                        # Extract query from args (it might be a dict or object)
-                        query = tool_args.get('query')
-                        yield {"type": "log", "content": f"Execution: Searching knowledge base for '{query}'..."}
-                        tool_result = lookup_guides.invoke(query)
-                    else:
-                        tool_result = f"Error: Tool {tool_name} not found."
-                    
-                    print(f"TOOL RESULT: {str(tool_result)[:500]}...")
-                    
-                    # Extract sources from tool result
-                    try:
-                        lines = str(tool_result).split('\n')
-                        for line in lines:
-                            if line.startswith("Source: "):
-                                source_name = line.replace("Source: ", "").strip()
-                                if source_name and source_name not in collected_sources:
-                                    collected_sources.append(source_name)
-                    except Exception as e:
-                        print(f"DEBUG: Error extracting sources: {e}")
-
-                    # Observation Log
-                    if "No relevant documents" in str(tool_result):
-                         yield {"type": "log", "content": "Observation: No relevant documents found. I may need to refine my search."}
-                    else:
-                         yield {"type": "log", "content": f"Observation: Found relevant policy information. Synthesizing answer..."}
-                    
-                    # Append tool result to messages
-                    print("DEBUG: Appending ToolMessage...")
-                    messages.append(ToolMessage(content=tool_result, tool_call_id=tool_id))
-                    print("DEBUG: ToolMessage appended.")
-            
+            if not response.tool_calls:
+                # Final Answer
+                yield from _final_events(response, step_stream.streamed_text, collected_sources, metrics)
+                return
+
+            # Execute tool calls (concurrently; observations and ToolMessages keep the call order)
+            for tool_call in response.tool_calls:
+                yield from _tool_call_events(tool_call)
+            tools_started = time.perf_counter()
+            results = _dispatch_tools(response.tool_calls, speculation if step == 0 else None)
+            for tool_call, (tool_result, docs, seconds) in zip(response.tool_calls, results):
+                _record_tool(metrics, tool_call, docs, seconds)
+                events, tool_message = _observe(tool_call, tool_result, collected_sources)
+                yield from events
+                messages.append(tool_message)
+            if metrics:
+                metrics.record_retrieval(time.perf_counter() - tools_started)
+
             # Force exit if max steps reached
-            if step == 4:
-                 print("AGENT: Max steps reached, giving up.")
-                 yield {"type": "answer", "content": "I apologize, but I am unable to find a specific answer after multiple attempts. Please contact the Service Desk for further assistance.", "needs_email_support": True}
-                 return
+            if step == MAX_STEPS - 1:
+                yield from _give_up_events(metrics)
+                return
+
+    except Exception as e:
+        logger.error("Agent error: %s", e)
+        yield {"type": "error", "content": str(e)}
+    finally:
+        if speculation:
+            speculation.future.cancel()  # Unused (answered directly, or the model searched for something else)
+
+async def _arun_agent_stream(user_query: str, chat_history: list = None, dev_settings: dict = None):
+    """Async counterpart of _run_agent_stream (same events, same steps)."""
+    if dev_settings is None: dev_settings = {}
+    if chat_history is None: chat_history = []
+
+    collected_sources = []
+    stream_answer = dev_settings.get('stream', STREAM_ANSWERS)
+    metrics = AgentMetrics() if dev_settings.get('collect_metrics') else None
+
+    if not llm:
+        yield {"type": "error", "content": "LLM not initialized."}
+        return
+
+    speculation = None
+    try:
+        llm_with_tools = get_llm_with_tools()
+        messages = _initial_messages(user_query, chat_history)
+        speculative_call = _speculative_call(user_query, chat_history, dev_settings)
+        if speculative_call:
+            speculation = _Speculation(user_query, _in_tool_pool(_execute_tool, speculative_call))
+
+        for step in range(MAX_STEPS):
+            if step == 0:
+                yield PLANNING_EVENT
             else:
-                # Final Answer
-                final_answer = response.content
-                
-                # Handle list-based content (common in newer Gemini versions)
-                if isinstance(final_answer, list):
-                    text_parts = []
-                    for part in final_answer:
-                        if isinstance(part, dict) and 'text' in part:
-                            text_parts.append(part['text'])
-                        elif isinstance(part, str):
-                            text_parts.append(part)
-                    final_answer = "".join(text_parts)
-                
-                if not response.tool_calls:
-                    print(f"AGENT ANSWER: {str(final_answer)[:200]}...")
-                    
-                    # Final thought before answer
-                    yield {"type": "log", "content": "Finalizing: Formulating response based on retrieved policies."}
-                    
-                    needs_support = "I cannot answer" in final_answer
-                    yield {
-                        "type": "answer", 
-                        "content": final_answer, 
-                        "needs_email_support": needs_support,
-                        "sources": collected_sources
-                    }
-                    return
+                _compact_history(messages)
+
+            step_stream = _StreamedStep()
+            with tracing.span("agent.llm", step=step + 1, streamed=stream_answer) as llm_span:
+                if stream_answer:
+                    # Events are yielded outside the slot: a slow client never holds one
+                    step_events = asyncio.Queue()
+                    producer = asyncio.ensure_future(
+                        _astream_step(llm_with_tools, messages, step_stream, step_events))
+                    try:
+                        while True:
+                            event = await step_events.get()
+                            if event is _STEP_END:
+                                break
+                            yield event
+                        response, llm_seconds = await producer
+                    finally:
+                        producer.cancel()
+                else:
+                    async with llm_slot():
+                        llm_started = time.perf_counter()
+                        response = await llm_with_tools.ainvoke(messages)
+                        llm_seconds = time.perf_counter() - llm_started
+                _annotate_llm_span(llm_span, response)
+                if speculation and step == 0:
+                    _record_speculation(llm_span, metrics, speculation, response.tool_calls)
+            if metrics:
+                metrics.record_llm(llm_seconds, response)
+            payload_log.debug("LLM response: %s", Truncated(response))
+            messages.append(response)
+
+            if not response.tool_calls:
+                for event in _final_events(response, step_stream.streamed_text, collected_sources, metrics):
+                    yield event
+                return
+
+            for tool_call in response.tool_calls:
+                for event in _tool_call_events(tool_call):
+                    yield event
+            # FAISS search and query embedding are blocking; run them on the tool pool, all calls at once
+            tools_started = time.perf_counter()
+            reused = speculation.match(response.tool_calls) if speculation and step == 0 else None
+            tasks = [speculation.future if i == reused else _in_tool_pool(_execute_tool, tool_call)
+                     for i, tool_call in enumerate(response.tool_calls)]
+            try:
+                for tool_call, task in zip(response.tool_calls, tasks):
+                    tool_result, docs, seconds = await task
+                    _record_tool(metrics, tool_call, docs, seconds)
+                    events, tool_message = _observe(tool_call, tool_result, collected_sources)
+                    for event in events:
+                        yield event
+                    messages.append(tool_message)
+            finally:
+                for task in tasks:
+                    task.cancel()
+            if metrics:
+                metrics.record_retrieval(time.perf_counter() - tools_started)
+
+            if step == MAX_STEPS - 1:
+                for event in _give_up_events(metrics):
+                    yield event
+                return
 
     except Exception as e:
-        logger.error(f"Agent Error: {e}")
+        logger.error("Agent error: %s", e)
         yield {"type": "error", "content": str(e)}
+    finally:
+        if speculation:
+            speculation.future.cancel()  # Unused (answered directly, or the model searched for something else)
 
 def ask_service_desk(user_query: str, dev_settings: dict = None) -> dict:
     # Simple wrapper around the stream for legacy calls
@@ -265,8 +885,7 @@ def summarize_conversation(history):
     """
     Summarizes the conversation history.
     """
-    if not llm:
-         init_clients()
+    ensure_clients()
 
     try:
         # Format history
@@ -289,5 +908,5 @@ def summarize_conversation(history):
         response = llm.invoke(prompt)
         return response.content
     except Exception as e:
-        logger.error(f"Summarization failed: {e}")
+        logger.error("Summarization failed: %s", e)
         return "Error generating summary."
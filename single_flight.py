@@ -0,0 +1,167 @@
+# single_flight.py
+"""
+Single-flight coalescing of identical in-flight answer streams.
+
+When many users ask the same question at once (an incident, a campus-wide email), only
+the first request runs the agent. Requests for the same key that arrive while it is
+still running subscribe to that run: they are sent every event produced so far and
+then each new event as it is produced. Once the run ends its key is released, and
+later requests are answered by the answer cache or start a new run.
+
+The run is driven by its own producer (a thread, or a task in async mode) rather than
+by the first request, so a client that disconnects never cuts the stream short for
+the others.
+"""
+import queue
+import asyncio
+import weakref
+import threading
+import contextvars
+import logging
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Flight:
+    """Events of one run so far, and the queues of its subscribers."""
+
+    def __init__(self, new_queue):
+        self.new_queue = new_queue
+        self.events = []
+        self.subscribers = []
+        self.done = False
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        with self.lock:
+            self.events.append(event)
+            for q in self.subscribers:
+                q.put_nowait(event)
+
+    def finish(self):
+        with self.lock:
+            self.done = True
+            for q in self.subscribers:
+                q.put_nowait(_DONE)
+            self.subscribers = []
+
+    def subscribe(self):
+        q = self.new_queue()
+        with self.lock:
+            for event in self.events:
+                q.put_nowait(event)
+            if self.done:
+                q.put_nowait(_DONE)
+            else:
+                self.subscribers.append(q)
+        return q
+
+
+class _FlightGroup:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0  # Requests served by another request's run
+
+    def _join(self, key, new_queue):
+        """(flight, subscriber queue, is_new); the caller must start the producer of a new flight."""
+        with self._lock:
+            flight = self._flights.get(key)
+            is_new = flight is None
+            if is_new:
+                flight = self._flights[key] = _Flight(new_queue)
+            else:
+                self.coalesced += 1
+            return flight, flight.subscribe(), is_new
+
+    def _release(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+class SingleFlight(_FlightGroup):
+    """Thread-based coalescing for the WSGI server."""
+
+    def stream(self, key, produce, joined_events=()):
+        """
+        Yields the events of produce() (a generator function), shared with every caller
+        that passes the same key while it runs. Callers that join a running flight are
+        first sent `joined_events`.
+        """
+        flight, events, is_new = self._join(key, queue.SimpleQueue)
+        if is_new:
+            context = contextvars.copy_context()  # Spans of the run belong to the first request's trace
+            threading.Thread(target=context.run, args=(self._produce, key, flight, produce),
+                             name="single-flight", daemon=True).start()
+        else:
+            logger.debug("Joined an in-flight answer for %r", key)
+            yield from joined_events
+        while True:
+            event = events.get()
+            if event is _DONE:
+                return
+            yield event
+
+    def _produce(self, key, flight, produce):
+        try:
+            for event in produce():
+                flight.publish(event)
+        except Exception as e:
+            logger.error("Coalesced answer failed: %s", e)
+            flight.publish({"type": "error", "content": str(e)})
+        finally:
+            self._release(key, flight)
+
+
+class AsyncSingleFlight(_FlightGroup):
+    """Coalescing for the ASGI server: producers are tasks on the event loop."""
+
+    def __init__(self):
+        super().__init__()
+        self._tasks = set()  # Strong references, so running producers are not garbage collected
+
+    async def stream(self, key, produce, joined_events=()):
+        """Async counterpart of SingleFlight.stream; produce() returns an async generator."""
+        flight, events, is_new = self._join(key, asyncio.Queue)
+        if is_new:
+            task = asyncio.get_running_loop().create_task(self._produce(key, flight, produce))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            logger.debug("Joined an in-flight answer for %r", key)
+            for event in joined_events:
+                yield event
+        while True:
+            event = await events.get()
+            if event is _DONE:
+                return
+            yield event
+
+    async def _produce(self, key, flight, produce):
+        try:
+            async for event in produce():
+                flight.publish(event)
+        except Exception as e:
+            logger.error("Coalesced answer failed: %s", e)
+            flight.publish({"type": "error", "content": str(e)})
+        finally:
+            self._release(key, flight)
+
+
+_async_flights = weakref.WeakKeyDictionary()  # One group per event loop (asyncio queues are loop-bound)
+
+
+def async_flights():
+    loop = asyncio.get_running_loop()
+    group = _async_flights.get(loop)
+    if group is None:
+        group = _async_flights[loop] = AsyncSingleFlight()
+    return group
@@ -207,12 +207,34 @@ document.addEventListener('DOMContentLoaded', () => {
             const decoder = new TextDecoder();
             let buffer = '';
             let finalAnswer = '';
+            let streamedAnswer = '';
+            let renderPending = false;
             let sources = [];
             let needsEmail = false;
 
             const answerTextDiv = document.createElement('div');
             bubble.appendChild(answerTextDiv);
 
+            const stopThoughtTimer = () => {
+                if (timerInterval) clearInterval(timerInterval);
+                timerInterval = null;
+                if (startTime) {
+                    const finalElapsed = Math.floor((Date.now() - startTime) / 1000);
+                    thoughtTitle.textContent = `Thought for ${finalElapsed}s`;
+                }
+            };
+
+            // Re-render streamed markdown at most once per animation frame
+            const renderStreamedAnswer = () => {
+                if (renderPending) return;
+                renderPending = true;
+                requestAnimationFrame(() => {
+                    renderPending = false;
+                    if (!finalAnswer) answerTextDiv.innerHTML = marked.parse(streamedAnswer);
+                    scrollToBottom();
+                });
+            };
+
             while (true) {
                 const { done, value } = await reader.read();
                 if (done) break;
@@ -250,17 +272,32 @@ document.addEventListener('DOMContentLoaded', () => {
                             // Auto-scroll thought content
                             thoughtContent.scrollTop = thoughtContent.scrollHeight;
 
+                        } else if (event.type === 'answer_delta') {
+                            // First token ends the thinking phase
+                            if (!streamedAnswer) stopThoughtTimer();
+                            if (typingIndicator.parentNode) typingIndicator.remove();
+
+                            streamedAnswer += event.content;
+                            renderStreamedAnswer();
+
+                        } else if (event.type === 'answer_reset') {
+                            // Model switched to a tool call; discard the partial text
+                            streamedAnswer = '';
+                            answerTextDiv.innerHTML = '';
+                            if (startTime && !timerInterval) {
+                                timerInterval = setInterval(() => {
+                                    const elapsed = Math.floor((Date.now() - startTime) / 1000);
+                                    thoughtTitle.textContent = `Thought for ${elapsed}s`;
+                                }, 1000);
+                            }
+
                         } else if (event.type === 'answer') {
                             finalAnswer = event.content;
                             needsEmail = event.needs_email_support;
                             sources = event.sources || [];
 
                             // Stop timer
-                            if (timerInterval) clearInterval(timerInterval);
-                            if (startTime) {
-                                const finalElapsed = Math.floor((Date.now() - startTime) / 1000);
-                                thoughtTitle.textContent = `Thought for ${finalElapsed}s`;
-                            }
+                            stopThoughtTimer();
 
                             // Remove typing indicator if it's still there
                             if (typingIndicator.parentNode) typingIndicator.remove();
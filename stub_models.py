@@ -0,0 +1,119 @@
+# stub_models.py
+"""
+Deterministic local stand-in for the Gemini chat model, for load tests and offline runs
+(LLM_BACKEND=stub; pair it with EMBEDDING_BACKEND=fake for embeddings).
+
+The stub follows the agent protocol: for the first STUB_TOOL_STEPS steps it asks for
+STUB_TOOL_CALLS lookup_guides calls, then answers. Every call waits STUB_LLM_LATENCY
+seconds before the first chunk and STUB_LLM_CHUNK_LATENCY between streamed chunks, with
+real sleeps in the sync path and asyncio sleeps in the async path, so both serving modes
+see realistic upstream waits without using a thread per waiting request.
+The same question always gets the same tool calls and answer.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# --- CONFIGURATION ---
+STUB_LLM_LATENCY = float(os.getenv("STUB_LLM_LATENCY", "0.5"))  # Seconds to first chunk
+STUB_LLM_CHUNK_LATENCY = float(os.getenv("STUB_LLM_CHUNK_LATENCY", "0.02"))  # Seconds between chunks
+STUB_TOOL_CALLS = int(os.getenv("STUB_TOOL_CALLS", "1"))  # lookup_guides calls per tool step
+STUB_TOOL_STEPS = int(os.getenv("STUB_TOOL_STEPS", "1"))  # Tool steps before answering
+STUB_ANSWER_WORDS = int(os.getenv("STUB_ANSWER_WORDS", "60"))
+
+_WORDS = (
+    "the policy requires staff and students to use university IT resources responsibly "
+    "access must be authorised and accounts may not be shared requests are logged through "
+    "the service desk portal and escalated when a procedure does not cover the case"
+).split()
+
+
+def _question(messages):
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            text = str(message.content)
+            return text.rsplit("Question: ", 1)[-1].strip()
+    return ""
+
+
+def _tool_steps_taken(messages):
+    return sum(1 for m in messages if isinstance(m, AIMessage) and m.tool_calls)
+
+
+class StubChatModel(BaseChatModel):
+    latency: float = STUB_LLM_LATENCY
+    chunk_latency: float = STUB_LLM_CHUNK_LATENCY
+    tool_calls: int = STUB_TOOL_CALLS
+    tool_steps: int = STUB_TOOL_STEPS
+    answer_words: int = STUB_ANSWER_WORDS
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self  # Always "calls" lookup_guides
+
+    # --- Deterministic behaviour ---
+
+    def _reply(self, messages):
+        question = _question(messages)
+        seed = int(hashlib.sha256(question.encode("utf-8")).hexdigest()[:8], 16)
+        step = _tool_steps_taken(messages)
+        if step < self.tool_steps:
+            calls = [{"name": "lookup_guides", "args": {"query": f"{question} (aspect {i + 1})" if i else question},
+                      "id": f"call_{seed:x}_{step}_{i}"}
+                     for i in range(self.tool_calls)]
+            return AIMessage(content="", tool_calls=calls)
+        words = [_WORDS[(seed + i * 7) % len(_WORDS)] for i in range(self.answer_words)]
+        answer = " ".join(words).capitalize() + "."
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        return AIMessage(content=answer, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": len(words),
+            "total_tokens": input_tokens + len(words),
+        })
+
+    def _chunks(self, message):
+        if message.tool_calls:
+            yield AIMessageChunk(content="", tool_call_chunks=[
+                {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                for i, c in enumerate(message.tool_calls)
+            ])
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield AIMessageChunk(content=word if last else word + " ",
+                                 usage_metadata=message.usage_metadata if last else None)
+
+    # --- Sync ---
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(self._reply(messages))):
+            if i:
+                time.sleep(self.chunk_latency)
+            yield ChatGenerationChunk(message=chunk)
+
+    # --- Async ---
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(self._reply(messages))):
+            if i:
+                await asyncio.sleep(self.chunk_latency)
+            yield ChatGenerationChunk(message=chunk)
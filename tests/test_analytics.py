@@ -0,0 +1,31 @@
+from analytics import AnalyticsRollups, LATENCY_BASE, percentile_from_histogram
+
+
+def _rollups(tmp_path):
+    rollups = AnalyticsRollups(path=str(tmp_path / "analytics_rollups.json"))
+    rollups._data = rollups._empty()
+    return rollups
+
+
+def test_zero_latency_records_count_towards_latency(tmp_path):
+    rollups = _rollups(tmp_path)
+    rollups._apply_query({"timestamp": "2026-01-05T10:00:00", "query": "wifi", "response_time": 0.0})
+    rollups._apply_query({"timestamp": "2026-01-05T10:01:00", "query": "wifi", "response_time": 0.0})
+    rollups._apply_query({"timestamp": "2026-01-05T10:02:00", "query": "vpn", "response_time": 4.0})
+
+    day = rollups._data["queries"]["2026-01-05"]
+    assert day["count"] == 3
+    assert day["latency_count"] == 3
+    assert day["latency_sum"] == 4.0
+    histogram = {int(bucket): count for bucket, count in day["histogram"].items()}
+    assert percentile_from_histogram(histogram, day["latency_count"], 50) == round(LATENCY_BASE, 2)
+
+
+def test_records_without_latency_are_counted_but_not_timed(tmp_path):
+    rollups = _rollups(tmp_path)
+    rollups._apply_query({"timestamp": "2026-01-05T10:00:00", "query": "wifi"})
+
+    day = rollups._data["queries"]["2026-01-05"]
+    assert day["count"] == 1
+    assert day["latency_count"] == 0
+    assert day["histogram"] == {}
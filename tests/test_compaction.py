@@ -0,0 +1,48 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from service_desk_bot import compact_tool_results
+
+
+def _result(source, words=1200):
+    return f"Source: {source}\n" + " ".join(["policy"] * words)
+
+
+def _tool_step(step, queries):
+    calls = [{"name": "lookup_guides", "args": {"query": q}, "id": f"call-{step}-{n}"}
+             for n, q in enumerate(queries)]
+    results = [ToolMessage(content=_result(f"{q} guide"), tool_call_id=call["id"])
+               for q, call in zip(queries, calls)]
+    return [AIMessage(content="", tool_calls=calls)] + results
+
+
+def _conversation(*steps):
+    messages = [SystemMessage(content="system"), HumanMessage(content="Question: wifi")]
+    for step, queries in enumerate(steps):
+        messages += _tool_step(step, queries)
+    return messages
+
+
+def test_parallel_results_of_the_current_step_are_kept_whole():
+    messages = _conversation(["eduroam", "vpn", "printing"])
+    original = [m.content for m in messages]
+
+    assert compact_tool_results(messages, budget=1000) == 0
+    assert [m.content for m in messages] == original
+
+
+def test_only_results_of_earlier_steps_are_compacted():
+    messages = _conversation(["eduroam", "vpn"], ["printing", "password reset", "email"])
+
+    assert compact_tool_results(messages, budget=1000) == 2
+    earlier = [m for m in messages[:6] if isinstance(m, ToolMessage)]
+    latest = [m for m in messages[6:] if isinstance(m, ToolMessage)]
+    assert all(m.additional_kwargs.get("compacted") for m in earlier)
+    assert earlier[0].content.startswith("[Earlier search for 'eduroam' omitted")
+    assert "Sources returned: eduroam guide." in earlier[0].content
+    assert not any(m.additional_kwargs.get("compacted") for m in latest)
+
+
+def test_earlier_results_within_budget_are_kept():
+    messages = _conversation(["eduroam"], ["vpn"])
+
+    assert compact_tool_results(messages, budget=100000) == 0
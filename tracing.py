@@ -0,0 +1,199 @@
+# tracing.py
+"""
+Lightweight request tracing for the agent loop.
+
+Each chat request opens a trace; the stages inside it (history formatting, every LLM
+call, every knowledge-base lookup split into query embedding and FAISS search, the
+stream flush to the client) are recorded as child spans. A finished trace is written
+as one OTLP/JSON `ExportTraceServiceRequest` per line to `traces.jsonl`, the same
+layout the OpenTelemetry Collector's file exporter produces, so the file can be
+loaded into any OTLP-compatible viewer. The analytics page summarises it per stage.
+
+Spans opened outside a trace (scripts, evaluation workers) are no-ops.
+"""
+import os
+import random
+import secrets
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from event_store import JsonlEventStore
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))  # Fraction of requests traced
+TRACE_DIR = os.getenv("TRACE_DIR", ".")
+# traces.jsonl is rotated to traces.jsonl.1 past this size, so at most twice this is kept on disk
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "100"))
+TRACE_LOG = "traces"
+
+SERVICE_NAME = "service-desk-agent"
+
+_current_span = ContextVar("current_span", default=None)
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_trace_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JsonlEventStore(TRACE_LOG, directory=TRACE_DIR, max_bytes=int(TRACE_MAX_MB * 1024 * 1024))
+        return _store
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}  # int64 is a string in OTLP/JSON
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stands in for a span when the request is not traced."""
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self._lock = threading.Lock()  # Child spans may finish on worker threads
+
+    def finish(self, span):
+        span.end_ns = span.end_ns or time.time_ns()
+        with self._lock:
+            self.spans.append(span)
+
+    def export(self):
+        with self._lock:
+            spans = [s.to_otlp() for s in self.spans]
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+            }]
+        }
+
+
+def _restore(token, previous):
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Generator finished in a different context (e.g. closed on client disconnect)
+        _current_span.set(previous)
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Starts a new trace with a root span (subject to sampling) and exports it when the block ends."""
+    if not TRACING_ENABLED or random.random() >= TRACE_SAMPLE_RATE:
+        yield NOOP_SPAN
+        return
+    root = Span(Trace(), name, attributes=attributes)
+    previous = _current_span.get()
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.error = repr(e)
+        raise
+    finally:
+        _restore(token, previous)
+        root.trace.finish(root)
+        try:
+            get_trace_store().append(root.trace.export())
+        except Exception as e:
+            logger.error("Failed to export trace: %s", e)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Times a stage as a child of the current span. A no-op outside a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    child = Span(parent.trace, name, parent_id=parent.span_id, attributes=attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        _restore(token, parent)
+        parent.trace.finish(child)
+
+
+def record_span(name, seconds, **attributes):
+    """
+    Records a stage whose time was accumulated in pieces (e.g. time spent writing
+    stream chunks to the client) as one span ending now.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, name, parent_id=parent.span_id, attributes=attributes)
+    child.end_ns = time.time_ns()
+    child.start_ns = child.end_ns - int(seconds * 1e9)
+    parent.trace.finish(child)
+
+
+def span_durations(record):
+    """Yields (root start in unix seconds, span name, duration in seconds) for an exported trace line."""
+    for resource_spans in record.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            spans = scope_spans.get("spans", [])
+            roots = [s for s in spans if not s.get("parentSpanId")]
+            started = int(roots[0]["startTimeUnixNano"]) / 1e9 if roots else None
+            for s in spans:
+                yield started, s["name"], (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e9
@@ -0,0 +1,373 @@
+# vector_store.py
+"""
+Process-wide FAISS vector store shared by the chat agent and the admin blueprint.
+
+- Searches run concurrently under a read lock; writes take the write lock.
+- The index is memory-mapped and chunks are read from an SQLite docstore on demand
+  (docstore.py), so worker processes share one page-cache copy and nothing is unpickled.
+- Writes are saved atomically as a new version directory published by one pointer
+  swap (index_layout.py), and serialised across processes with a file lock.
+- When another process (ingest_data.py, another worker) replaces the index on disk,
+  the next search loads the new index and hot-swaps it in for readers.
+- The index is tagged with the embedding model that built it (embedding.json); loading
+  it with a different model fails loudly instead of returning meaningless neighbours.
+- A BM25 index over the same chunks (lexical_index.py) is kept alongside, so searches
+  can be keyword, vector or hybrid (reciprocal rank fusion of both).
+"""
+import os
+import json
+import time
+import shutil
+import threading
+import logging
+from contextlib import contextmanager
+
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+from docstore import DOCSTORE_FILE, SqliteDocstore, read_all, read_positions, write_docstore
+from embedding_backends import embedding_model_name
+from file_lock import locked_file
+from index_layout import INDEX_FILE, INDEX_MODEL_FILE, current_dir, index_fingerprint, new_version_dir, publish_version
+from index_types import apply_search_params
+from lexical_index import LexicalIndex, load_or_build, reciprocal_rank_fusion
+from context_assembly import relevance
+import tracing
+
+logger = logging.getLogger(__name__)
+
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index")
+LEGACY_DOCSTORE_FILE = "index.pkl"  # LangChain's pickled docstore, converted on first load
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() == "true"  # Map index.faiss instead of reading it into RAM
+LOAD_ATTEMPTS = 3  # Loads retried when the index is replaced mid-load
+RELOAD_CHECK_INTERVAL = float(os.getenv("INDEX_RELOAD_CHECK_INTERVAL", "2"))  # Seconds between disk checks
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")  # vector | bm25 | hybrid (per deployment)
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # Hits taken from each ranking before fusion
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+class ReadWriteLock:
+    """Many readers or one writer. Waiting writers block new readers so writes are not starved."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read_locked(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_locked(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class EmbeddingModelMismatch(ValueError):
+    """The index on disk was built with a different embedding model than the one configured."""
+
+
+def read_index_model(index_path):
+    """{"model", "dimension"} the index was built with (model None if unknown), or None for an untagged index."""
+    try:
+        with open(os.path.join(current_dir(index_path), INDEX_MODEL_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def check_index_model(index_path, embeddings, dimension):
+    tag = read_index_model(index_path)
+    if tag is None:
+        return  # Built before indexes were tagged
+    model = embedding_model_name(embeddings)
+    if (model and tag.get("model") and tag.get("model") != model) or tag.get("dimension") != dimension:
+        raise EmbeddingModelMismatch(
+            f"Index at {index_path} was built with '{tag.get('model')}' ({tag.get('dimension')} dims) "
+            f"but the configured embedding model is '{model}'. "
+            "Re-run ingest_data.py to rebuild it, or switch EMBEDDING_BACKEND back."
+        )
+
+
+def atomic_save(vectorstore, index_path):
+    """
+    Saves a FAISS store so readers never see a half-written or mixed index: the index,
+    docstore and embedding model tag are written to a new version directory, which is
+    then published in one atomic pointer swap (see index_layout.py).
+    """
+    version_dir = new_version_dir(index_path)
+    try:
+        faiss.write_index(vectorstore.index, os.path.join(version_dir, INDEX_FILE))
+        write_docstore(vectorstore, os.path.join(version_dir, DOCSTORE_FILE))
+        with open(os.path.join(version_dir, INDEX_MODEL_FILE), "w", encoding="utf-8") as f:
+            json.dump({"model": embedding_model_name(vectorstore.embedding_function),
+                       "dimension": vectorstore.index.d}, f)
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    publish_version(index_path, version_dir)
+
+
+def index_exists(index_path):
+    return os.path.exists(os.path.join(current_dir(index_path), INDEX_FILE))
+
+
+def migrate_legacy_index(index_path):
+    """
+    One-time conversion of an index saved by FAISS.save_local (pickled docstore) to the
+    SQLite docstore. The pickle was written by our own ingestion, so it is trusted here.
+    A no-op for indexes that are already converted.
+    """
+    if (os.path.exists(os.path.join(current_dir(index_path), DOCSTORE_FILE))
+            or not os.path.exists(os.path.join(index_path, LEGACY_DOCSTORE_FILE))):
+        return
+    with locked_file(os.path.join(index_path, ".lock")):
+        if os.path.exists(os.path.join(current_dir(index_path), DOCSTORE_FILE)):
+            return  # Another process converted it first
+        logger.warning("Converting the pickled docstore in %s to %s...", index_path, DOCSTORE_FILE)
+        # No embeddings: the model that built a legacy index is unknown, so only its dimension is tagged
+        store = FAISS.load_local(index_path, None, allow_dangerous_deserialization=True)
+        atomic_save(store, index_path)
+
+
+def load_index(index_path, embeddings, mmap=INDEX_MMAP):
+    """
+    Loads a saved index as a LangChain FAISS store. With mmap the vectors are mapped
+    from disk and chunks are fetched from SQLite per lookup (read-mostly serving);
+    without, both are read into memory (ingestion, which edits the store heavily).
+    All files are read from the version published when the load starts.
+    """
+    migrate_legacy_index(index_path)
+    directory = current_dir(index_path)
+    docstore_path = os.path.join(directory, DOCSTORE_FILE)
+    if mmap:
+        index = faiss.read_index(os.path.join(directory, INDEX_FILE), faiss.IO_FLAG_MMAP_IFC)
+        docstore = SqliteDocstore(docstore_path)
+        positions = docstore.positions()  # From the same open file the chunks will be read from
+    else:
+        index = faiss.read_index(os.path.join(directory, INDEX_FILE))
+        docstore = InMemoryDocstore(read_all(docstore_path))
+        positions = read_positions(docstore_path)
+    return FAISS(embeddings, index, docstore, positions)
+
+
+def writable_index(index):
+    """Private in-memory copy of a memory-mapped index (mapped vectors cannot be appended to)."""
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+class VectorStoreService:
+    def __init__(self, embeddings, index_path=FAISS_INDEX_PATH):
+        self.embeddings = embeddings
+        self.index_path = index_path
+        self._store = None
+        self._lexical = None
+        self._lock = ReadWriteLock()
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.load()
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.index_path, ".lock")
+
+    @property
+    def is_loaded(self):
+        return self._store is not None
+
+    def load(self):
+        """
+        Loads (or reloads) the index from disk and swaps it in. Returns True if an index was
+        loaded. A load that overlaps a save is retried, so the store swapped in is always
+        the version its fingerprint describes; if saves keep landing, the current store is kept.
+        """
+        for _ in range(LOAD_ATTEMPTS):
+            if not index_exists(self.index_path):
+                return False
+            fingerprint = index_fingerprint(self.index_path)
+            store = load_index(self.index_path, self.embeddings)
+            if fingerprint == index_fingerprint(self.index_path):
+                break
+            logger.info("FAISS index at %s was replaced while loading, retrying...", self.index_path)
+        else:
+            logger.warning("FAISS index at %s kept changing while loading; keeping the current index.", self.index_path)
+            return False
+        check_index_model(self.index_path, self.embeddings, store.index.d)
+        apply_search_params(store.index)
+        # In vector mode BM25 is only loaded if a search asks for it (see _ensure_lexical)
+        lexical = load_or_build(store, self.index_path, fingerprint) if RETRIEVAL_MODE != "vector" else None
+        with self._lock.write_locked():
+            self._store = store
+            self._lexical = lexical
+            self._fingerprint = fingerprint
+        logger.info("FAISS index loaded from %s (%d vectors).", self.index_path, store.index.ntotal)
+        return True
+
+    def reload_if_changed(self, force=False):
+        """
+        Hot-swaps in a newer index written by another process. Checked at most every few
+        seconds; `force` (before a write) checks now, waits for a reload already in progress
+        and raises if a newer index cannot be loaded, so the write never starts from a stale one.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+        if not self._reload_lock.acquire(blocking=force):
+            return  # Another thread is already reloading
+        try:
+            self._last_check = now
+            if index_fingerprint(self.index_path) != self._fingerprint:
+                logger.info("FAISS index changed on disk, reloading...")
+                if not self.load() and force and index_exists(self.index_path):
+                    raise RuntimeError(f"Could not load the current FAISS index at {self.index_path}.")
+        except Exception as e:
+            if force:
+                raise
+            logger.error("Index reload failed, keeping the current index: %s", e)
+        finally:
+            self._reload_lock.release()
+
+    def _embed_query(self, query):
+        # Embed outside the read lock (network call); timed separately from the FAISS search
+        with tracing.span("retrieval.embed"):
+            return self.embeddings.embed_query(query)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        self.reload_if_changed()
+        if self._store is None:
+            return []
+        vector = self._embed_query(query)
+        with tracing.span("retrieval.search", k=k), self._lock.read_locked():
+            if self._store is None:
+                return []
+            return self._store.similarity_search_by_vector(vector, k=k, **kwargs)
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        """[(Document, L2 distance)], closest first."""
+        self.reload_if_changed()
+        if self._store is None:
+            return []
+        vector = self._embed_query(query)
+        with tracing.span("retrieval.search", k=k), self._lock.read_locked():
+            if self._store is None:
+                return []
+            return self._store.similarity_search_with_score_by_vector(vector, k=k, **kwargs)
+
+    def _ensure_lexical(self):
+        with self._reload_lock:
+            if self._lexical is None and self._store is not None:
+                lexical = load_or_build(self._store, self.index_path, self._fingerprint)
+                with self._lock.write_locked():
+                    self._lexical = lexical
+
+    def search(self, query, k=4, mode=None):
+        """
+        [(Document, relevance 0-1)], best first. `mode` (default RETRIEVAL_MODE) is
+        'vector', 'bm25', or 'hybrid': both rankings fused with reciprocal rank fusion.
+        """
+        mode = mode or RETRIEVAL_MODE
+        if mode not in ("vector", "bm25", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode '{mode}'. Expected 'vector', 'bm25' or 'hybrid'.")
+        self.reload_if_changed()
+        if self._store is None:
+            return []
+        if mode != "vector" and self._lexical is None:
+            self._ensure_lexical()
+        vector = self._embed_query(query) if mode != "bm25" else None
+        fetch_k = k if mode == "vector" else max(k, HYBRID_CANDIDATES)
+
+        with self._lock.read_locked():
+            if self._store is None:
+                return []
+            vector_hits = []
+            if vector is not None:
+                with tracing.span("retrieval.search", k=fetch_k):
+                    vector_hits = self._store.similarity_search_with_score_by_vector(vector, k=fetch_k)
+                if mode == "vector":
+                    return [(doc, relevance(distance)) for doc, distance in vector_hits]
+
+            with tracing.span("retrieval.bm25", k=fetch_k) as bm25_span:
+                keyword_hits = self._lexical.search(query, k=fetch_k) if self._lexical else []
+                bm25_span.set(hits=len(keyword_hits))
+            if mode == "bm25":
+                top = keyword_hits[0][1] if keyword_hits else 1.0
+                ranked = [(doc_id, score / top) for doc_id, score in keyword_hits]
+            else:
+                vector_ranking = [doc.id for doc, _ in vector_hits]
+                keyword_ranking = [doc_id for doc_id, _ in keyword_hits]
+                ranked = reciprocal_rank_fusion([vector_ranking, keyword_ranking], k=RRF_K)
+            results = []
+            for doc_id, score in ranked:
+                doc = self._store.docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    results.append((doc, round(score, 4)))
+                    if len(results) == k:
+                        break
+            return results
+
+    def add_documents(self, docs, ids=None):
+        """Adds documents and atomically publishes the index as a new version, then reloads it."""
+        # Embed before taking any lock; searches keep running meanwhile
+        texts = [d.page_content for d in docs]
+        vectors = self.embeddings.embed_documents(texts)
+        text_embeddings = list(zip(texts, vectors))
+        metadatas = [d.metadata for d in docs]
+
+        with locked_file(self.lock_path):
+            # Pick up writes made by other processes first so they are not overwritten
+            self.reload_if_changed(force=True)
+            with self._lock.write_locked():
+                if self._store is None:
+                    self._store = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+                else:
+                    self._store.index = writable_index(self._store.index)
+                    self._store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+                atomic_save(self._store, self.index_path)
+                if self._lexical is not None:
+                    # Saved for the new version now, so the load below does not rebuild it
+                    LexicalIndex.from_faiss(self._store, index_fingerprint(self.index_path)).save(self.index_path)
+            # Serve the published version from disk again (mapped, with INDEX_MMAP) and drop
+            # the private copy made for the write
+            with self._reload_lock:
+                self.load()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_vector_store(embeddings=None):
+    """Returns the process-wide VectorStoreService, creating it on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            if embeddings is None:
+                from embedding_cache import get_embeddings
+                embeddings = get_embeddings()
+            _service = VectorStoreService(embeddings)
+        return _service